@@ -3,9 +3,16 @@
     for additional processing functions to connect class instances
 """
 
+import os
 import glob
+import json
+import time
+import pickle
+import hashlib
 import logging
 import sys
+import weakref
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from pyproj import CRS
@@ -13,6 +20,8 @@ from owslib.ogcapi.features import Features
 import geopandas as gpd
 import datetime as dt
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 
 
 # USER INPUT PROCESSING
@@ -59,6 +68,85 @@ def check_crs(crs_in: int) -> bool:
     except Exception as gen_err:
         return False
 
+# GEOMETRY HELPERS
+# equal-area projection (WGS 84 / NSIDC EASE-Grid 2.0 Global, metres) for burned area terms
+EQUAL_AREA_CRS = 6933
+
+def add_area_columns(polygons):
+    """ cache per polygon areas on the frame, once: 'AREA_EQUAL' the area projected to EQUAL_AREA_CRS
+        (square metres; the frame's own crs units when it has no crs)
+        returns: polygons, with the column added in place
+    """
+    if polygons.crs is None or polygons.shape[0] == 0:
+        polygons['AREA_EQUAL'] = polygons.geometry.area.to_numpy(dtype='float64')
+    else:
+        polygons['AREA_EQUAL'] = polygons.geometry.to_crs(EQUAL_AREA_CRS).area.to_numpy(dtype='float64')
+    
+    return polygons
+
+def bounds_array(polygons):
+    """ contiguous (n, 4) float64 array of [minx, miny, maxx, maxy] per polygon row """
+    return np.ascontiguousarray(polygons.geometry.bounds.to_numpy(dtype='float64'))
+
+def bounds_overlap(ref_bounds, feds_bounds, within=None):
+    """ vectorized envelope test
+            ref_bounds: (n, 4) bounds_array of the reference polygons
+            feds_bounds: [minx, miny, maxx, maxy] of the polygon to test against
+            within: optional ascending positions of ref_bounds to restrict the test to
+        returns: ascending positions whose envelope overlaps (or touches) feds_bounds
+    """
+    rows = ref_bounds if within is None else ref_bounds[within]
+    mask = ((rows[:, 0] <= feds_bounds[2]) & (rows[:, 2] >= feds_bounds[0]) &
+            (rows[:, 1] <= feds_bounds[3]) & (rows[:, 3] >= feds_bounds[1]))
+    
+    return np.flatnonzero(mask) if within is None else within[mask]
+
+def geometry_lookup(polygons):
+    """ id-indexed accessor built once per frame
+        returns: dict {'index' id: (geometry, equal area, equal-area geometry)};
+                 rows sharing an id are unioned and their areas summed (same totals as a per-id row filter)
+                 equal-area geometries + areas are projected here from the current geometry column
+                 (frames without a crs are used as is)
+    """
+    if polygons.crs is None or polygons.shape[0] == 0:
+        equal_geometries = polygons.geometry.values
+    else:
+        equal_geometries = polygons.geometry.to_crs(EQUAL_AREA_CRS).values
+    equal_areas = gpd.GeoSeries(equal_geometries).area.tolist()
+    
+    lookup = {}
+    for an_id, geometry, equal_area, equal_geometry in zip(polygons['index'].tolist(), polygons.geometry.values,
+                                                           equal_areas, equal_geometries):
+        if an_id in lookup:
+            geometry = lookup[an_id][0].union(geometry)
+            equal_area = lookup[an_id][1] + equal_area
+            equal_geometry = lookup[an_id][2].union(equal_geometry)
+        lookup[an_id] = (geometry, equal_area, equal_geometry)
+    
+    return lookup
+
+# geometry_lookup per live frame, see cached_geometry_lookup:
+# id(frame) -> (frame ref, geometry array ref, crs, 'index' ids, lookup); entries are dropped with their frame
+_FRAME_LOOKUPS = {}
+
+def cached_geometry_lookup(polygons):
+    """ geometry_lookup of polygons, built once per frame and shared by every caller (detection
+        geometry_by_id, run_calculations, batch_best_simplify...); rebuilt when the frame's geometry
+        column, crs or 'index' ids have changed since
+    """
+    geometry = polygons.geometry.values
+    ids = polygons['index'].to_numpy()
+    entry = _FRAME_LOOKUPS.get(id(polygons))
+    if entry is not None and entry[0]() is polygons:
+        if entry[1]() is geometry and entry[2] == polygons.crs and np.array_equal(entry[3], ids):
+            return entry[4]
+    else:
+        weakref.finalize(polygons, _FRAME_LOOKUPS.pop, id(polygons), None)
+    
+    lookup = geometry_lookup(polygons)
+    _FRAME_LOOKUPS[id(polygons)] = (weakref.ref(polygons), weakref.ref(geometry), polygons.crs, ids, lookup)
+    return lookup
+
 # S3 PROCESSING & ACCESS
 def split_s3_path(s3_path: str):
     """ for bucket and key extraction"""
@@ -80,5 +168,181 @@ def split_s3_path(s3_path: str):
     
     return bucket, key, nested
 
+# CHECKPOINTS
+def checkpoint_key(*args) -> str:
+    """ stable hash of run arguments; a checkpoint is only resumed under the same key """
+    return hashlib.sha1(repr(args).encode('utf-8')).hexdigest()
+
+def save_checkpoint(path: str, key: str, payload):
+    """ pickle payload with its key; written to a temp file then swapped in so a crash never leaves half a file """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as checkpoint_file:
+        pickle.dump({'key': key, 'payload': payload}, checkpoint_file)
+    os.replace(tmp_path, path)
+
+def load_checkpoint(path: str, key: str):
+    """ return saved payload if path holds a checkpoint for key, otherwise None """
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as checkpoint_file:
+            saved = pickle.load(checkpoint_file)
+    except Exception as gen_err:
+        logging.warning(f'Unable to read checkpoint {path}: {gen_err}; starting fresh')
+        return None
+    if saved.get('key') != key:
+        logging.warning(f'Checkpoint {path} was written for different arguments; starting fresh')
+        return None
+    return saved['payload']
+
+# MEMO CACHE
+class MemoCache():
+    """ MemoCache
+        Bounded key -> value cache: an in-memory LRU tier of max_entries and, when directory is set,
+        an on-disk tier of one pickle per key kept under max_bytes (oldest files evicted first)
+        so entries survive across runs; disk hits are promoted to memory
+        max_weight + weigher: optionally also bound the memory tier by the summed weigher(value),
+        e.g. vertex counts for geometries
+        e.g. pass to run_calculations(cache=...)
+    """
+    
+    def __init__(self, max_entries: int = 100000, directory: str = None, max_bytes: int = 512 * 1024**2,
+                 max_weight: float = None, weigher=None):
+        assert (max_weight is None) == (weigher is None), "ERR: max_weight and weigher are set together"
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self._max_weight = max_weight
+        self._weigher = weigher
+        self._weights = {}
+        self.weight = 0
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(os.path.getsize(cache_file) for cache_file in glob.glob(os.path.join(directory, '*.pkl')))
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, key: str, default=None):
+        """ cached value for key (memory first, then disk) or default """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        
+        if self._directory is not None:
+            try:
+                with open(self._disk_path(key), 'rb') as cache_file:
+                    value = pickle.load(cache_file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                value = None
+            if value is not None:
+                self.hits += 1
+                self._remember(key, value)
+                return value
+        
+        self.misses += 1
+        return default
+    
+    def put(self, key: str, value):
+        """ store value under key in both tiers """
+        self._remember(key, value)
+        
+        if self._directory is not None and not os.path.exists(self._disk_path(key)):
+            # temp file then swap so readers never see half an entry
+            tmp_path = self._disk_path(key) + f'.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as cache_file:
+                pickle.dump(value, cache_file)
+            self._disk_bytes += os.path.getsize(tmp_path)
+            os.replace(tmp_path, self._disk_path(key))
+            if self._disk_bytes > self._max_bytes:
+                self._evict_disk()
+    
+    def stats(self) -> dict:
+        """ {'hits', 'misses', 'entries', 'weight'} """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'weight': self.weight}
+    
+    def _remember(self, key, value):
+        """ memory tier insert, dropping least recently used entries past max_entries / max_weight """
+        if self._weigher is not None:
+            self.weight -= self._weights.pop(key, 0)
+            self._weights[key] = self._weigher(value)
+            self.weight += self._weights[key]
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries or (self._max_weight is not None and self.weight > self._max_weight):
+            dropped, _ = self._entries.popitem(last=False)
+            self.weight -= self._weights.pop(dropped, 0)
+    
+    def _disk_path(self, key):
+        return os.path.join(self._directory, f'{key}.pkl')
+    
+    def _evict_disk(self):
+        """ delete oldest cache files until the disk tier fits max_bytes """
+        cache_files = sorted(glob.glob(os.path.join(self._directory, '*.pkl')), key=os.path.getmtime)
+        self._disk_bytes = sum(os.path.getsize(cache_file) for cache_file in cache_files)
+        for cache_file in cache_files:
+            if self._disk_bytes <= self._max_bytes:
+                break
+            try:
+                size = os.path.getsize(cache_file)
+                os.remove(cache_file)
+                self._disk_bytes -= size
+            except OSError:
+                continue
+
+# TIMING
+class PhaseTimer():
+    """ PhaseTimer
+        Accumulates wall time, call counts and row counts per named pipeline phase
+        e.g. pass to init_search(timer=...) / run_calculations(timer=...) then read summary()
+    """
+    
+    def __init__(self):
+        self._phases = {}
+    
+    @contextmanager
+    def phase(self, name: str, rows: int = 0):
+        """ time the enclosed block under name """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.record(name, time.perf_counter() - start, 1, rows)
+    
+    def record(self, name: str, seconds: float, calls: int = 1, rows: int = 0):
+        """ add a measurement to phase name """
+        entry = self._phases.setdefault(name, {'seconds': 0.0, 'calls': 0, 'rows': 0})
+        entry['seconds'] += seconds
+        entry['calls'] += calls
+        entry['rows'] += int(rows)
+    
+    def add_rows(self, name: str, rows: int):
+        """ count rows against phase name without timing anything """
+        self.record(name, 0.0, 0, rows)
+    
+    def merge(self, summary: dict):
+        """ fold in a summary() from another timer, e.g. one filled in a worker process """
+        for name, entry in summary.items():
+            self.record(name, entry['seconds'], entry['calls'], entry['rows'])
+    
+    def summary(self) -> dict:
+        """ {phase: {'seconds', 'calls', 'rows'}} """
+        return {name: dict(entry) for name, entry in self._phases.items()}
+    
+    def to_json(self) -> str:
+        return json.dumps(self.summary(), indent=2)
+
+def timed(timer, name: str, rows: int = 0):
+    """ timer.phase(name, rows) or a no-op context when timer is None """
+    if timer is None:
+        return nullcontext()
+    return timer.phase(name, rows)
+
 # DECORATORS
 # TODO
\ No newline at end of file
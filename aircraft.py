@@ -18,6 +18,7 @@ import geopandas as gpd
 from datetime import datetime
 from datetime import timedelta
 from functools import singledispatch
+from Utilities import bounds_array, cached_geometry_lookup, add_area_columns
 
 pd.set_option('display.max_columns',None)
 
@@ -81,6 +82,7 @@ class AircraftDetection():
         self._polygons = None
         self._ds_url = None
         self._ds_read_type = None
+        self._bounds = None
         
         # SINGLE SETUP
         self.__set_up_master()
@@ -110,6 +112,21 @@ class AircraftDetection():
     def polygons(self):
         return self._polygons
     
+    @property
+    def bounds(self):
+        """ (n, 4) float64 [minx, miny, maxx, maxy] per polygon; computed once, aligned with polygons rows """
+        if self._bounds is None and self._polygons is not None:
+            self._bounds = bounds_array(self._polygons)
+        return self._bounds
+    
+    @property
+    def geometry_by_id(self):
+        """ {'index' id: (geometry, equal area, equal-area geometry)} for constant time pair lookups; computed once
+            per polygons frame and reused by the metrics stage (see Utilities.cached_geometry_lookup) """
+        if self._polygons is None:
+            return None
+        return cached_geometry_lookup(self._polygons)
+    
     
     # MASTER SET UP FUNCTION
     def __set_up_master(self):
@@ -173,7 +190,8 @@ class AircraftDetection():
         else:
             assert self._title == "none", "Fatal: reached custom shp local reading despite a non-'none' title"
 
-        self._polygons = df
+        # equal-area per polygon areas computed once
+        self._polygons = add_area_columns(df)
         
         return self
     
@@ -240,7 +258,8 @@ class AircraftDetection():
         
         gdf['index'] = gdf.index
         
-        self._polygons = gdf
+        # equal-area per polygon areas computed once
+        self._polygons = add_area_columns(gdf)
     
         return self
     
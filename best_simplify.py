@@ -1,7 +1,10 @@
 import glob
 import sys
+import hashlib
 import logging
+import numpy as np
 import pandas as pd
+import shapely
 import geopandas as gpd
 import fsspec
 import boto3
@@ -10,28 +13,59 @@ import datetime as dt
 import logging
 
 from pyproj import CRS
+from concurrent.futures import ProcessPoolExecutor
 from owslib.ogcapi.features import Features
 from datetime import datetime, timedelta
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError, EndpointConnectionError
 
 # python file importats
+import Utilities
 from calculations import *
 
+# calc methods the sweep can evaluate over a whole batch of tolerances at once -> metricArrays key
+BATCH_METRICS = { ratioCalculation: 'ratio',
+                  accuracyCalculation: 'accuracy',
+                  precisionCalculation: 'precision',
+                  recallCalculation: 'recall',
+                  IOUCalculation: 'iou',
+                  f1ScoreCalculation: 'f1',
+                  symmDiffRatioCalculation: 'symm_ratio'
+                }
+
 def init_best_simplify(sat_fire, 
                        air_fire, 
                        calc_method, 
                        lowerPref, 
                        top_performance,
-                       base_tolerance
+                       base_tolerance,
+                       strategy='sweep',
+                       budget=30,
+                       history='compact',
+                       keep_top=0,
+                       cache=None
                       ):
     """ run simplify algorithm and return back best result
         use calc_method and control bool to indicate "direction" of best performance
         
         e.g. calc method symmDiffRatioCalculation(feds_poly, ref_poly)
         false since higher ratio value is better similarity
+        
+        strategy: 'sweep' scores every tolerance (best_simplification);
+                  'bracketed' runs bracketed_simplification with at most budget metric evaluations
+                  (len(performance_history) is the evaluation count either way)
+        history: 'compact' returns simple_history as a SimplifyHistory (per step records, geometries
+                 regenerated on access, keep_top best steps held); 'full' keeps every simplified GeoSeries in a list
+        cache: optional simplify_cache() to share simplified geometries across runs, e.g. when
+               tuning several calc_methods on the same perimeter (None always re-simplifies)
     """
     
     top_tolerance = 0
+    assert history in ['compact', 'full'], f"Unknown simplify history mode {history}"
+    simple_history = SimplifyHistory(sat_fire, lowerPref, keep_top, cache) if history == 'compact' else []
+    if strategy == 'bracketed':
+        return bracketed_simplification(sat_fire, air_fire, top_performance, top_tolerance, base_tolerance,
+                                        calc_method, lowerPref, budget, simple_history=simple_history, cache=cache)
+    assert strategy == 'sweep', f"Unknown simplify strategy {strategy}"
     threshold = best_simplification(sat_fire, 
                                     air_fire, 
                                     top_performance, 
@@ -39,21 +73,126 @@ def init_best_simplify(sat_fire,
                                     base_tolerance,
                                     calc_method,
                                     lowerPref,
-                                    [],
+                                    simple_history,
                                     [], 
-                                    []
+                                    [],
+                                    cache
                                    )
     
     return threshold
 
-def simplify_geometry(shape, tolerance):
+def batch_best_simplify(index_pairs,
+                        feds_polygons,
+                        ref_polygons,
+                        calc_method,
+                        lowerPref,
+                        top_performance,
+                        base_tolerance,
+                        strategy='sweep',
+                        budget=30,
+                        workers=1,
+                        chunk_size=None,
+                        timer=None,
+                        cache=None,
+                        feds_lookup=None,
+                        ref_lookup=None
+                       ):
+    """ init_best_simplify for every pair of final_index_pairs, e.g. to calibrate a whole season
+        index_pairs: [(feds 'index' id, ref 'index' id or None), ...]
+        calc_method, lowerPref, top_performance, base_tolerance, strategy, budget: as init_best_simplify
+        workers: > 1 spreads pairs across a process pool in chunks of chunk_size (pair order kept)
+        timer: optional Utilities.PhaseTimer, records 'best_simplify' per optimized pair
+        cache: optional simplify_cache(); pooled workers each fill their own copy
+        feds_lookup, ref_lookup: as calculations.run_calculations
+        
+        return: DataFrame, one row per pair: feds_index, ref_index (Int64), best_tolerance, best_score
+                (Float64, <NA> for unmatched pairs or when no tolerance beat top_performance), evaluations
+    """
+    
+    index_pairs = list(index_pairs)
+    settings = {'calc_method': calc_method, 'lowerPref': lowerPref, 'top_performance': top_performance,
+                'base_tolerance': base_tolerance, 'strategy': strategy, 'budget': budget, 'cache': cache}
+    if feds_lookup is None:
+        feds_lookup = Utilities.cached_geometry_lookup(feds_polygons)
+    if ref_lookup is None:
+        ref_lookup = Utilities.cached_geometry_lookup(ref_polygons)
+    
+    with Utilities.timed(timer, 'batch_best_simplify', len(index_pairs)):
+        if workers > 1:
+            if chunk_size is None:
+                chunk_size = max(1, -(-len(index_pairs) // (workers * 4)))
+            chunks = [index_pairs[first:first + chunk_size] for first in range(0, len(index_pairs), chunk_size)]
+            rows = []
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_simplify_worker,
+                                     initargs=(feds_lookup, ref_lookup, feds_polygons.crs, ref_polygons.crs, settings)) as pool:
+                # map keeps submission order, so rows come back in index_pairs order
+                for chunk_rows, chunk_timings in pool.map(_simplify_chunk, chunks):
+                    if timer is not None:
+                        timer.merge(chunk_timings)
+                    rows.extend(chunk_rows)
+        else:
+            rows = [_best_simplify_pair(feds_ref_pair, feds_lookup, ref_lookup, feds_polygons.crs, ref_polygons.crs, settings, timer)
+                    for feds_ref_pair in index_pairs]
+    
+    table = pd.DataFrame(rows, columns=['feds_index', 'ref_index', 'best_tolerance', 'best_score', 'evaluations'])
+    for key in ['feds_index', 'ref_index', 'evaluations']:
+        table[key] = pd.array([None if value is None or pd.isna(value) else value for value in table[key].tolist()], dtype='Int64')
+    for key in ['best_tolerance', 'best_score']:
+        table[key] = pd.to_numeric(table[key]).astype('float64').astype('Float64')
+    
+    return table
+
+def _best_simplify_pair(feds_ref_pair, feds_lookup, ref_lookup, feds_crs, ref_crs, settings, timer=None):
+    """ one batch_best_simplify row: [feds id, ref id, best tolerance, best score, evaluations] """
+    if feds_ref_pair[1] is None:
+        return [feds_ref_pair[0], None, None, None, 0]
+    
+    with Utilities.timed(timer, 'best_simplify', 1):
+        sat_fire = gpd.GeoDataFrame({'index': [feds_ref_pair[0]]}, geometry=[feds_lookup[feds_ref_pair[0]][0]], crs=feds_crs)
+        air_fire = gpd.GeoDataFrame({'index': [feds_ref_pair[1]]}, geometry=[ref_lookup[feds_ref_pair[1]][0]], crs=ref_crs)
+        result = init_best_simplify(sat_fire, air_fire, settings['calc_method'], settings['lowerPref'],
+                                    settings['top_performance'], settings['base_tolerance'],
+                                    settings['strategy'], settings['budget'], cache=settings['cache'])
+    
+    top_tolerance, performance_history, tolerance_history = result[0], result[2], result[3]
+    evaluations = len(performance_history)
+    # top_tolerance stays 0 when nothing beat top_performance
+    best_score = performance_history[tolerance_history.index(top_tolerance)] if top_tolerance in tolerance_history else None
+    
+    return [feds_ref_pair[0], feds_ref_pair[1], top_tolerance if best_score is not None else None, best_score, evaluations]
+
+# per-process state for pooled batch_best_simplify; filled once per worker by _init_simplify_worker
+_SIMPLIFY_STATE = {}
+
+def _init_simplify_worker(feds_lookup, ref_lookup, feds_crs, ref_crs, settings):
+    """ pool initializer: keep geometry lookups + search settings for the worker lifetime """
+    _SIMPLIFY_STATE['feds_lookup'] = feds_lookup
+    _SIMPLIFY_STATE['ref_lookup'] = ref_lookup
+    _SIMPLIFY_STATE['feds_crs'] = feds_crs
+    _SIMPLIFY_STATE['ref_crs'] = ref_crs
+    _SIMPLIFY_STATE['settings'] = settings
+
+def _simplify_chunk(chunk_pairs):
+    """ pool task: batch_best_simplify rows for a chunk of pairs
+        returns: (chunk rows, chunk timer summary)
+    """
+    chunk_timer = Utilities.PhaseTimer()
+    chunk_rows = [_best_simplify_pair(feds_ref_pair, _SIMPLIFY_STATE['feds_lookup'], _SIMPLIFY_STATE['ref_lookup'],
+                                      _SIMPLIFY_STATE['feds_crs'], _SIMPLIFY_STATE['ref_crs'], _SIMPLIFY_STATE['settings'],
+                                      chunk_timer)
+                  for feds_ref_pair in chunk_pairs]
+    return chunk_rows, chunk_timer.summary()
+
+def simplify_geometry(shape, tolerance, cache=None):
         """ shape: to simplify
             tolerance: passed to shapely tol
+            cache: optional simplify_cache() (None to always recompute)
             return: simplified shape
         """
         # keep preserve_topology as default (true)
         assert isinstance(shape, gpd.GeoDataFrame)
-        return shape.geometry.simplify(tolerance)
+        return gpd.GeoSeries(simplify_sweep(shape, [tolerance], cache)[0], index=shape.index, crs=shape.crs)
 
 def best_simplification (feds, nifc, 
                          top_performance, 
@@ -63,39 +202,321 @@ def best_simplification (feds, nifc,
                          lowerPref,
                          simple_history,
                          performance_history,
-                         tolerance_history
+                         tolerance_history,
+                         cache=None
                         ):
     """ feds: feds source
         nifc: external source to compare to
         top_performance: best numeric value (default is worst value aka > 100 % error)
         top_tolerance: corresponding simplification with best performance
-        base_tolerance: counter for tracking progress from limit -> 0
+        base_tolerance: sweep start; tolerances step down by 0.001 while above 0.001
         calc_method
         lowerPref: true if a "better" score is considered a lower value
+        cache: optional simplify_cache()
 
-        return: top_tolerance (best tolerance value from recursion)
+        return: top_tolerance (best tolerance value of the sweep), simple_history, performance_history, tolerance_history
 
     """
-    if base_tolerance <= 0.001:
+    tolerances = tolerance_sweep(base_tolerance)
+    if len(tolerances) == 0:
         return top_tolerance, simple_history, performance_history, tolerance_history
 
-    # simplify + calculate performance
-    simplified_feds = simplify_geometry(feds, base_tolerance)
-    simple_history.append(simplified_feds)
-    curr_performance = calc_method(simplified_feds, nifc)
-    performance_history.append(curr_performance)
-    tolerance_history.append(base_tolerance)
+    # simplify + score + record the sweep chunk by chunk
+    performances = score_tolerances(feds, nifc, tolerances, calc_method, simple_history, cache=cache)
 
-    # if performance "better" (depends on passed bool / method) -> persist
-    if curr_performance < top_performance and lowerPref:
-        top_performance = curr_performance
-        top_tolerance = base_tolerance
-    elif curr_performance > top_performance and not lowerPref:
-        top_performance = curr_performance
-        top_tolerance = base_tolerance
+    for base_tolerance, curr_performance in zip(tolerances, performances):
+        performance_history.append(curr_performance)
+        tolerance_history.append(base_tolerance)
+
+        # if performance "better" (depends on passed bool / method) -> persist
+        if curr_performance < top_performance and lowerPref:
+            top_performance = curr_performance
+            top_tolerance = base_tolerance
+        elif curr_performance > top_performance and not lowerPref:
+            top_performance = curr_performance
+            top_tolerance = base_tolerance
+
+    return top_tolerance, simple_history, performance_history, tolerance_history
+
+def tolerance_sweep(base_tolerance, step=0.001, floor=0.001):
+    """ tolerances visited by the sweep: base_tolerance stepping down by step while above floor
+        (repeated subtraction, so values match the step-by-step sweep exactly)
+    """
+    tolerances = []
+    while base_tolerance > floor:
+        tolerances.append(base_tolerance)
+        base_tolerance -= step
+    return tolerances
+
+def simplify_sweep(shape, tolerances, cache=None):
+    """ shape: to simplify
+        tolerances: every tolerance to simplify at
+        cache: optional simplify_cache() shared across sweeps (None to always recompute)
+        return: (len(tolerances), rows) object array; row i is shape simplified at tolerances[i]
+    """
+    geoms = np.asarray(shape.geometry.values, dtype=object)
+    tolerances = np.asarray(tolerances, dtype='float64')
+    if cache is None:
+        return _simplify_elementwise(geoms[np.newaxis, :], tolerances[:, np.newaxis])
+    
+    # serve cached (geometry, tolerance) pairs, simplify only the misses
+    digests = [hashlib.sha1(geom.wkb).hexdigest() for geom in geoms]
+    simplified = np.empty((tolerances.shape[0], geoms.shape[0]), dtype=object)
+    missing = []
+    for step, tolerance in enumerate(tolerances):
+        for row, digest in enumerate(digests):
+            simplified[step, row] = cache.get(simplify_cache_key(digest, tolerance))
+            if simplified[step, row] is None:
+                missing.append((step, row))
+    
+    if len(missing) != 0:
+        steps, rows = np.array(missing).T
+        computed = _simplify_elementwise(geoms[rows], tolerances[steps])
+        for step, row, simplified_geom in zip(steps, rows, computed):
+            simplified[step, row] = simplified_geom
+            cache.put(simplify_cache_key(digests[row], tolerances[step]), simplified_geom)
+    
+    return simplified
+
+def simplify_cache(max_vertices=1000000, max_entries=4096):
+    """ simplified geometry cache for simplify_sweep, keyed by simplify_cache_key; bounded by entry
+        count and by the total vertices held, cache.stats() reports hits / misses
+    """
+    return Utilities.MemoCache(max_entries=max_entries, max_weight=max_vertices, weigher=_coordinate_count)
 
-    # reduce and keep recursing down
-    base_tolerance -= 0.001
+def simplify_cache_key(digest, tolerance):
+    """ simplify_cache key: sha1 of the geometry's WKB + exact tolerance """
+    return f'{digest}:{float(tolerance)!r}'
 
-    return best_simplification(feds, nifc, top_performance, top_tolerance, base_tolerance, calc_method, lowerPref, simple_history, performance_history, tolerance_history)
+def _simplify_elementwise(geoms, tolerances):
+    """ geoms simplified at tolerances, element-wise with numpy broadcasting """
+    # keep preserve_topology as default (true)
+    if hasattr(shapely, 'simplify'):
+        # shapely 2: one vectorized call
+        return shapely.simplify(geoms, tolerances, preserve_topology=True)
+    geoms, tolerances = np.broadcast_arrays(geoms, tolerances)
+    simplified = np.empty(geoms.shape, dtype=object)
+    for position in np.ndindex(geoms.shape):
+        simplified[position] = geoms[position].simplify(tolerances[position])
+    return simplified
+
+def score_tolerances(feds, nifc, tolerances, calc_method, simple_history, chunk_size=16, cache=None):
+    """ simplify feds at each tolerance, score against nifc and record into simple_history,
+        chunk_size tolerances at a time so only one chunk of simplified geometries is alive at once
+        cache: optional simplify_cache()
+        return: list of scores, one per tolerance
+    """
+    performances = []
+    for first in range(0, len(tolerances), chunk_size):
+        chunk_tolerances = tolerances[first:first + chunk_size]
+        simplified = simplify_sweep(feds, chunk_tolerances, cache)
+        chunk_performances = evaluate_sweep(simplified, feds, nifc, calc_method, chunk_size)
+        record_history(simple_history, feds, simplified, chunk_tolerances, chunk_performances)
+        performances.extend(chunk_performances)
+    return performances
+
+def evaluate_sweep(simplified, feds, nifc, calc_method, chunk_size=16):
+    """ calc_method score of every simplify_sweep row against nifc
+        known calc methods on single polygon pairs are computed with metricArrays, chunk_size rows
+        at a time and with only the overlay the metric needs; anything else is called once per tolerance
+        return: list of scores, one per row
+    """
+    if calc_method in BATCH_METRICS and feds.shape[0] == 1 and nifc.shape[0] == 1:
+        metric = BATCH_METRICS[calc_method]
+        nifc_geom = nifc.geometry.values[0]
+        scores = []
+        for first in range(0, simplified.shape[0], chunk_size):
+            feds_geoms = gpd.GeoSeries(simplified[first:first + chunk_size, 0], crs=feds.crs)
+            if metric == 'ratio':
+                # area ratio, no overlay needed
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    chunk_scores = feds_geoms.area.values / nifc_geom.area
+            else:
+                nifc_geoms = gpd.GeoSeries([nifc_geom] * feds_geoms.shape[0], crs=nifc.crs)
+                chunk_scores = metricArrays(confusionArrays(feds_geoms, nifc_geoms))[metric]
+            scores.extend(float(score) for score in chunk_scores)
+        return scores
+
+    return [calc_method(gpd.GeoSeries(simplified_row, index=feds.index, crs=feds.crs), nifc) for simplified_row in simplified]
+
+def bracketed_simplification(feds, nifc, 
+                             top_performance, 
+                             top_tolerance, 
+                             base_tolerance, 
+                             calc_method, 
+                             lowerPref,
+                             budget=30,
+                             coarse_points=8,
+                             simple_history=None,
+                             cache=None
+                            ):
+    """ best_simplification on the same tolerance grid with far fewer metric evaluations:
+        a coarse pass of coarse_points evenly spaced tolerances (one batch), then golden-section
+        narrowing around the best coarse tolerance (assumes the score is unimodal there), then every
+        tolerance left inside the bracket and, with budget to spare, neighbours of the best one
+        budget: max metric evaluations
+        simple_history: list or SimplifyHistory to record into (default SimplifyHistory)
+        cache: optional simplify_cache()
+
+        return: top_tolerance, simple_history, performance_history, tolerance_history (evaluation order,
+                one entry per metric evaluation)
+    """
+    grid = tolerance_sweep(base_tolerance)
+    scores = {}
+    performance_history, tolerance_history = [], []
+    if simple_history is None:
+        simple_history = SimplifyHistory(feds, lowerPref, cache=cache)
+
+    def evaluate(positions):
+        """ score unseen grid positions as one batch, within budget """
+        positions = [position for position in dict.fromkeys(positions) if position not in scores]
+        positions = positions[:max(0, budget - len(scores))]
+        if len(positions) == 0:
+            return
+        performances = score_tolerances(feds, nifc, [grid[position] for position in positions], calc_method, simple_history, cache=cache)
+        for position, curr_performance in zip(positions, performances):
+            scores[position] = curr_performance
+            performance_history.append(curr_performance)
+            tolerance_history.append(grid[position])
+
+    def rank(position):
+        """ lower is better """
+        return scores[position] if lowerPref else -scores[position]
+
+    if len(grid) != 0 and budget > 0:
+        # coarse pass
+        coarse = sorted(set(np.linspace(0, len(grid) - 1, min(coarse_points, budget, len(grid))).round().astype(int).tolist()))
+        evaluate(coarse)
+        best = min(scores, key=lambda position: (rank(position), position))
+        at = coarse.index(best)
+        low, high = coarse[max(at - 1, 0)], coarse[min(at + 1, len(coarse) - 1)]
+
+        # golden-section narrowing on grid positions
+        golden = (np.sqrt(5) - 1) / 2
+        while high - low > 2 and len(scores) < budget:
+            left = high - int(round((high - low) * golden))
+            right = low + int(round((high - low) * golden))
+            if left >= right:
+                break
+            evaluate([left, right])
+            if left not in scores or right not in scores:
+                break
+            if (rank(left), left) <= (rank(right), right):
+                high = right
+            else:
+                low = left
+
+        # exhaust the final bracket
+        evaluate(range(low, high + 1))
+
+        # leftover budget: step from the best tolerance to a local optimum
+        while len(scores) < budget:
+            best = min(scores, key=lambda position: (rank(position), position))
+            neighbours = [position for position in (best - 1, best + 1) if 0 <= position < len(grid) and position not in scores]
+            if len(neighbours) == 0:
+                break
+            evaluate(neighbours)
+
+    # same selection as the sweep, over evaluated tolerances in sweep order
+    for position in sorted(scores):
+        curr_performance = scores[position]
+        if curr_performance < top_performance and lowerPref:
+            top_performance = curr_performance
+            top_tolerance = grid[position]
+        elif curr_performance > top_performance and not lowerPref:
+            top_performance = curr_performance
+            top_tolerance = grid[position]
+
+    logging.info(f'Bracketed simplify search: {len(scores)} of {len(grid)} tolerances evaluated')
+    return top_tolerance, simple_history, performance_history, tolerance_history
+
+def record_history(simple_history, feds, simplified, tolerances, performances):
+    """ add one simplify_sweep batch to simple_history: compact records for a SimplifyHistory,
+        full simplified GeoSeries for a plain list
+    """
+    if isinstance(simple_history, SimplifyHistory):
+        simple_history.add_batch(simplified, tolerances, performances)
+        return
+    for simplified_row in simplified:
+        simple_history.append(gpd.GeoSeries(simplified_row, index=feds.index, crs=feds.crs))
+
+class SimplifyHistory():
+    """ SimplifyHistory
+        Memory-bounded simple_history: one compact record per step (tolerance, score, vertex count, area);
+        history[i] re-simplifies the source at step i's tolerance, except for the keep_top best scoring
+        steps whose geometry is held. Supports len(), indexing and iteration like the list it replaces
+        cache: optional simplify_cache() for the regenerated steps
+    """
+    
+    def __init__(self, source, lowerPref=False, keep_top=0, cache=None):
+        self._source = source
+        self._cache = cache
+        self._lowerPref = lowerPref
+        self._keep_top = keep_top
+        self._tolerances = []
+        self._scores = []
+        self._vertices = []
+        self._areas = []
+        self._kept = {}
+    
+    def __len__(self):
+        return len(self._tolerances)
+    
+    def __getitem__(self, step):
+        if step < 0:
+            step += len(self)
+        if not 0 <= step < len(self):
+            raise IndexError(f"Simplify history step {step} out of range")
+        if step in self._kept:
+            return self._kept[step]
+        return self._series(simplify_sweep(self._source, [self._tolerances[step]], self._cache)[0])
+    
+    def __iter__(self):
+        for step in range(len(self)):
+            yield self[step]
+    
+    @property
+    def records(self):
+        """ DataFrame of tolerance, score, vertices, area per step """
+        return pd.DataFrame({'tolerance': self._tolerances, 'score': self._scores,
+                             'vertices': self._vertices, 'area': self._areas})
+    
+    def add_batch(self, simplified, tolerances, scores):
+        """ record a simplify_sweep batch: (steps, rows) geometries with their tolerances + scores """
+        geoms = gpd.GeoSeries(simplified.ravel(), crs=self._source.crs)
+        if hasattr(geoms, 'count_coordinates'):
+            vertices = geoms.count_coordinates().to_numpy()
+        else:
+            vertices = np.array([_coordinate_count(geom) for geom in geoms])
+        vertices = vertices.reshape(simplified.shape).sum(axis=1)
+        areas = geoms.area.to_numpy().reshape(simplified.shape).sum(axis=1)
+        
+        for simplified_row, tolerance, score, vertex_count, area in zip(simplified, tolerances, scores, vertices, areas):
+            self._tolerances.append(tolerance)
+            self._scores.append(score)
+            self._vertices.append(int(vertex_count))
+            self._areas.append(float(area))
+            if self._keep_top > 0:
+                self._keep(len(self) - 1, simplified_row)
+    
+    def _keep(self, step, simplified_row):
+        """ hold step's geometry if it ranks in the keep_top best scores (earlier steps win ties) """
+        ranked = sorted(list(self._kept) + [step],
+                        key=lambda kept_step: (self._scores[kept_step] if self._lowerPref else -self._scores[kept_step], kept_step))
+        if step in ranked[:self._keep_top]:
+            self._kept[step] = self._series(simplified_row)
+            for dropped in ranked[self._keep_top:]:
+                self._kept.pop(dropped, None)
+    
+    def _series(self, simplified_row):
+        return gpd.GeoSeries(simplified_row, index=self._source.index, crs=self._source.crs)
 
+def _coordinate_count(geom):
+    """ vertex count of a (multi)polygon, for geopandas without count_coordinates """
+    if geom is None or geom.is_empty:
+        return 0
+    if hasattr(geom, 'geoms'):
+        return sum(_coordinate_count(part) for part in geom.geoms)
+    if hasattr(geom, 'exterior'):
+        return len(geom.exterior.coords) + sum(len(ring.coords) for ring in geom.interiors)
+    return len(geom.coords)
@@ -1,6 +1,11 @@
+import os
+import json
+import math
 import glob
+import hashlib
 import sys
 import logging
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import fsspec
@@ -10,13 +15,42 @@ import datetime as dt
 import logging
 
 from pyproj import CRS
+from concurrent.futures import ProcessPoolExecutor
 from owslib.ogcapi.features import Features
 from datetime import datetime, timedelta
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError, EndpointConnectionError
 
-
-def run_calculations(index_pairs, feds_polygons, ref_polygons):
-        """ orchestrate all calculations; either return back to enable output write or write here"""
+import Utilities
+
+
+# metric keys produced per pair, in run_calculations / print_output order
+METRIC_KEYS = ['ratio', 'accuracy', 'precision', 'recall', 'iou', 'f1', 'symm_ratio']
+# method='raster' also reports the bound on its TP area error
+RASTER_KEYS = METRIC_KEYS + ['tp_error']
+# table columns holding areas (confusion terms + raster TP error); every other value column is a ratio
+AREA_KEYS = ['TP', 'FP', 'FN', 'TN', 'FEDS_B', 'REF_B', 'AREA_TOTAL', 'tp_error']
+# version of what a pair's metrics mean, part of every pairCacheKey;
+# bump whenever the metric computation changes so cached (e.g. on disk) results are not reused
+METRICS_SCHEMA = f'3:equal-area-{Utilities.EQUAL_AREA_CRS}'
+
+def run_calculations(index_pairs, feds_polygons, ref_polygons, timer=None, method='algebra', validate=False,
+                     workers=1, chunk_size=None, feds_lookup=None, ref_lookup=None, cache=None, resolution=None):
+        """ orchestrate all calculations; either return back to enable output write or write here
+            timer: optional Utilities.PhaseTimer, records 'run_calculations' and per pair 'metrics'
+            method, validate, resolution: passed to confusionMatrix (resolution in EQUAL_AREA_CRS metres);
+                                          method='raster' adds a 'tp_error' list
+            workers: > 1 spreads pairs across a process pool in chunks of chunk_size
+                     (results keep index_pairs order); 1 runs serially in this process
+            feds_lookup, ref_lookup: Utilities.geometry_lookup of each frame (e.g. sat.geometry_by_id);
+                                     by default the frame's shared Utilities.cached_geometry_lookup
+            cache: optional Utilities.MemoCache of pair metrics keyed by pairCacheKey; unchanged pairs
+                   (same geometries, CRS and method) are served from it, e.g. across runs with a disk tier
+        """
+        
+        if feds_lookup is None:
+            feds_lookup = Utilities.cached_geometry_lookup(feds_polygons)
+        if ref_lookup is None:
+            ref_lookup = Utilities.cached_geometry_lookup(ref_polygons)
         
         calculations = { 'index_pairs': index_pairs,
                          'ratio': [],
@@ -27,47 +61,236 @@ def run_calculations(index_pairs, feds_polygons, ref_polygons):
                          'f1': [],
                          'symm_ratio': []
                        }
-                                 
+        if method == 'raster':
+            calculations['tp_error'] = []
+        
+        # index_pairs may be a generator: record pairs as they are consumed
+        consumed_pairs = []
+        with Utilities.timed(timer, 'run_calculations'):
+            if workers > 1:
+                pair_results = _iter_pooled_calculations(list(index_pairs), feds_polygons, ref_polygons, timer, method, validate,
+                                                         workers, chunk_size, feds_lookup, ref_lookup, cache, resolution)
+            else:
+                pair_results = iter_calculations(index_pairs, feds_polygons, ref_polygons, timer, method, validate,
+                                                 feds_lookup, ref_lookup, cache, resolution)
+            
+            for feds_ref_pair, pair_calculations in pair_results:
+                consumed_pairs.append(feds_ref_pair)
+                # add to tracking arr
+                for key in pair_calculations:
+                    calculations[key].append(pair_calculations[key])
+        calculations['index_pairs'] = consumed_pairs
+        if timer is not None:
+            timer.add_rows('run_calculations', len(consumed_pairs))
+            
+        # verify same sizing
+        for key in calculations: 
+            assert len(calculations[key]) == len(consumed_pairs), f"FATAL: mismatching sizing of arr at key {key} for calculations"
+        
+        return calculations
+
+def iter_calculations(index_pairs, feds_polygons, ref_polygons, timer=None, method='algebra', validate=False,
+                      feds_lookup=None, ref_lookup=None, cache=None, resolution=None):
+        """ generator form of run_calculations: yields (feds_ref_pair, {metric: value}) per pair
+            index_pairs can itself be a generator (e.g. search_iterator.iter_matched_pairs)
+            so metrics are computed while matching is still running
+            timer: optional Utilities.PhaseTimer, records 'metrics' per evaluated pair
+            method, validate, resolution: passed to confusionMatrix
+            feds_lookup, ref_lookup: Utilities.geometry_lookup of each frame; by default the frame's shared
+                                     Utilities.cached_geometry_lookup
+            cache: optional Utilities.MemoCache of pair metrics (bypassed when validate is set)
+        """
+        
+        if feds_lookup is None:
+            feds_lookup = Utilities.cached_geometry_lookup(feds_polygons)
+        if ref_lookup is None:
+            ref_lookup = Utilities.cached_geometry_lookup(ref_polygons)
+        if validate:
+            cache = None
+        crs_token = _crsToken(feds_polygons, ref_polygons)
+        method_token = _methodToken(method, resolution)
+        
         for feds_ref_pair in index_pairs: # e.g. (4, 1) <- feds index 4 best matches with ref poly at index 1
-                                 
-            skip_first_key = True
-                                 
+            
             # no reference polygon --> attach none to tracked calculations
             if (feds_ref_pair[1] is None):
-                for key in calculations:
-                    if skip_first_key:
-                        skip_first_key = False
-                        continue  # Skip the first key
-                    calculations[key].append(None)
+                yield feds_ref_pair, {key: None for key in (RASTER_KEYS if method == 'raster' else METRIC_KEYS)}
                 continue
            
-            # fetch corresponding polygons
-            feds_poly = feds_polygons[feds_polygons['index'] == feds_ref_pair[0]]
-            ref_poly = ref_polygons[ref_polygons['index'] == feds_ref_pair[1]]
-               
-            # run through calculations
-            ratio = ratioCalculation(feds_poly, ref_poly)
-            accuracy = accuracyCalculation(feds_poly, ref_poly)
-            precision = precisionCalculation(feds_poly, ref_poly)
-            recall = recallCalculation(feds_poly, ref_poly)
-            iou= IOUCalculation(feds_poly, ref_poly)
-            f1 = f1ScoreCalculation(feds_poly, ref_poly) 
-            symm_ratio = symmDiffRatioCalculation(feds_poly, ref_poly) # indep calc
+            with Utilities.timed(timer, 'metrics', 1):
+                # fetch corresponding polygons by id
+                feds_geom, feds_area, feds_equal_geom = feds_lookup[feds_ref_pair[0]]
+                ref_geom, ref_area, ref_equal_geom = ref_lookup[feds_ref_pair[1]]
+                
+                pair_calculations = None
+                if cache is not None:
+                    pair_key = pairCacheKey(feds_geom, ref_geom, crs_token, method_token)
+                    pair_calculations = cache.get(pair_key)
+                    if pair_calculations is not None:
+                        pair_calculations = dict(pair_calculations)
+                
+                if pair_calculations is None:
+                    # every metric derives from the confusion terms, all computed on the
+                    # equal-area geometries projected in the lookup (areas in square metres)
+                    if method == 'algebra' and not validate:
+                        confusion = confusionFromGeometries(feds_equal_geom, ref_equal_geom, feds_area, ref_area)
+                    elif method == 'raster' and not validate:
+                        confusion = rasterConfusion(feds_equal_geom, ref_equal_geom, resolution, feds_area, ref_area)
+                    else:
+                        # overlay paths work on frames
+                        feds_poly = gpd.GeoDataFrame(geometry=[feds_equal_geom], crs=_equalAreaCrs(feds_polygons))
+                        ref_poly = gpd.GeoDataFrame(geometry=[ref_equal_geom], crs=_equalAreaCrs(ref_polygons))
+                        confusion = confusionMatrix(feds_poly, ref_poly, method, validate, resolution=resolution)
+                    pair_calculations = metricsFromConfusion(confusion)
+                    if cache is not None:
+                        cache.put(pair_key, dict(pair_calculations))
+            
+            # yield outside the timed block: time spent by the consumer is not 'metrics' time
+            yield feds_ref_pair, pair_calculations
+    
+def run_calculations_batched(index_pairs, feds_polygons, ref_polygons, timer=None, feds_lookup=None, ref_lookup=None):
+        """ vectorized run_calculations: aligns all pairs into two geometry arrays and computes
+            intersection areas and envelopes element-wise
+            feds_lookup, ref_lookup: as run_calculations
+            return: DataFrame, one row per pair: feds_index, ref_index, confusion terms, METRIC_KEYS
+                    (NaN metrics for pairs without a reference polygon)
+        """
+        
+        with Utilities.timed(timer, 'run_calculations_batched'):
+            pairs = pd.DataFrame(list(index_pairs), columns=['feds_index', 'ref_index'])
+            matched = pairs['ref_index'].notna().values
+            if timer is not None:
+                timer.add_rows('run_calculations_batched', pairs.shape[0])
             
-            # add to tracking arr                    
-            calculations['ratio'].append(ratio)
-            calculations['accuracy'].append(accuracy)
-            calculations['precision'].append(precision)
-            calculations['recall'].append(recall)
-            calculations['iou'].append(iou)
-            calculations['f1'].append(f1)
-            calculations['symm_ratio'].append(symm_ratio)
+            # one geometry per id (rows sharing an id are merged)
+            if feds_lookup is None:
+                feds_lookup = Utilities.cached_geometry_lookup(feds_polygons)
+            if ref_lookup is None:
+                ref_lookup = Utilities.cached_geometry_lookup(ref_polygons)
+            feds_rows = [feds_lookup[feds_index] for feds_index in pairs.loc[matched, 'feds_index']]
+            ref_rows = [ref_lookup[ref_index] for ref_index in pairs.loc[matched, 'ref_index']]
+            # terms are computed on the lookup's equal-area geometries (areas in square metres)
+            feds_geoms = gpd.GeoSeries([row[2] for row in feds_rows], crs=_equalAreaCrs(feds_polygons))
+            ref_geoms = gpd.GeoSeries([row[2] for row in ref_rows], crs=_equalAreaCrs(ref_polygons))
             
-        # verify same sizing
-        for key in calculations: 
-            assert len(calculations[key]) == len(index_pairs), f"FATAL: mismatching sizing of arr at key {key} for calculations"
+            feds_area = np.array([row[1] for row in feds_rows], dtype='float64')
+            ref_area = np.array([row[1] for row in ref_rows], dtype='float64')
+            confusion = confusionArrays(feds_geoms, ref_geoms, feds_area, ref_area)
+            
+            columns = {term: confusion[term] for term in ['TP', 'FP', 'FN', 'TN', 'FEDS_B', 'REF_B', 'AREA_TOTAL']}
+            columns.update(metricArrays(confusion))
+            
+            # scatter matched rows back; unmatched pairs stay NaN
+            for key, values in columns.items():
+                full = np.full(pairs.shape[0], np.nan, dtype='float64')
+                full[matched] = values
+                pairs[key] = full
+            
+            pairs['feds_index'] = _nullableIds(pairs['feds_index'])
+            pairs['ref_index'] = _nullableIds(pairs['ref_index'])
         
-        return calculations
+        return pairs
+
+def _nullableIds(ids):
+        """ Int64 array of ids with <NA> where no id is attached """
+        return pd.array([None if an_id is None or pd.isna(an_id) else an_id for an_id in list(ids)], dtype='Int64')
+
+def pairCacheKey(feds_geom, ref_geom, crs_token, method='algebra'):
+        """ content address of a pair: sha1 over both geometries' WKB, the CRS, the confusion method
+            and METRICS_SCHEMA (so entries written by an older metric computation are never served)
+        """
+        digest = hashlib.sha1(feds_geom.wkb)
+        digest.update(b'|')
+        digest.update(ref_geom.wkb)
+        digest.update(f'|{crs_token}|{method}|{METRICS_SCHEMA}'.encode('utf-8'))
+        return digest.hexdigest()
+
+def _methodToken(method, resolution):
+        """ method part of pairCacheKey; raster results also depend on the grid resolution """
+        return f'raster:{resolution}' if method == 'raster' else method
+
+def _equalAreaCrs(polygons):
+        """ crs of the lookup's equal-area geometries (None when the frame has no crs) """
+        return Utilities.EQUAL_AREA_CRS if polygons.crs else None
+
+def _areaUnits(polygons):
+        """ unit name of reported areas: square equal-area crs units, None (unknown) when the frame has no crs """
+        return f'square {CRS.from_epsg(Utilities.EQUAL_AREA_CRS).axis_info[0].unit_name}' if polygons.crs else None
+
+def _crsToken(feds_polygons, ref_polygons):
+        """ CRS part of pairCacheKey """
+        return f'{feds_polygons.crs.to_wkt() if feds_polygons.crs else None}|{ref_polygons.crs.to_wkt() if ref_polygons.crs else None}'
+
+def _iter_pooled_calculations(index_pairs, feds_polygons, ref_polygons, timer, method, validate, workers, chunk_size,
+                              feds_lookup, ref_lookup, cache=None, resolution=None):
+        """ iter_calculations over a process pool; polygon frames are shipped once per worker
+            cache: looked up here, only misses are sent to the pool and their results stored back
+        """
+        
+        # serve cached pairs in this process
+        cached, pair_keys = {}, {}
+        if cache is not None and not validate:
+            crs_token = _crsToken(feds_polygons, ref_polygons)
+            for position, feds_ref_pair in enumerate(index_pairs):
+                if feds_ref_pair[1] is None:
+                    continue
+                pair_keys[position] = pairCacheKey(feds_lookup[feds_ref_pair[0]][0], ref_lookup[feds_ref_pair[1]][0],
+                                                   crs_token, _methodToken(method, resolution))
+                pair_calculations = cache.get(pair_keys[position])
+                if pair_calculations is not None:
+                    cached[position] = dict(pair_calculations)
+        pending_pairs = [feds_ref_pair for position, feds_ref_pair in enumerate(index_pairs) if position not in cached]
+        
+        if chunk_size is None:
+            chunk_size = max(1, -(-len(pending_pairs) // (workers * 4)))
+        chunks = [pending_pairs[first:first + chunk_size] for first in range(0, len(pending_pairs), chunk_size)]
+        
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_calculation_worker,
+                                 initargs=(feds_polygons, ref_polygons, feds_lookup, ref_lookup, method, validate,
+                                           resolution)) as pool:
+            # map keeps submission order, so pairs come back in index_pairs order
+            pending_results = _iter_chunk_results(pool.map(_calculate_chunk, chunks), timer)
+            for position, feds_ref_pair in enumerate(index_pairs):
+                if position in cached:
+                    yield feds_ref_pair, cached[position]
+                    continue
+                pair_calculations = next(pending_results)
+                if position in pair_keys:
+                    cache.put(pair_keys[position], dict(pair_calculations))
+                yield feds_ref_pair, pair_calculations
+
+def _iter_chunk_results(chunk_outputs, timer):
+        """ flatten pooled (chunk_results, chunk_timings) into per pair results, merging timings """
+        for chunk_results, chunk_timings in chunk_outputs:
+            if timer is not None:
+                timer.merge(chunk_timings)
+            yield from chunk_results
+
+# per-process state for pooled calculations; filled once per worker by _init_calculation_worker
+_CALCULATION_STATE = {}
+
+def _init_calculation_worker(feds_polygons, ref_polygons, feds_lookup, ref_lookup, method, validate, resolution):
+        """ pool initializer: keep polygon frames and id lookups for the worker lifetime """
+        _CALCULATION_STATE['feds'] = feds_polygons
+        _CALCULATION_STATE['ref'] = ref_polygons
+        _CALCULATION_STATE['feds_lookup'] = feds_lookup
+        _CALCULATION_STATE['ref_lookup'] = ref_lookup
+        _CALCULATION_STATE['method'] = method
+        _CALCULATION_STATE['validate'] = validate
+        _CALCULATION_STATE['resolution'] = resolution
+
+def _calculate_chunk(chunk_pairs):
+        """ pool task: metrics for a chunk of pairs
+            returns: (list of per pair metric dicts, chunk timer summary)
+        """
+        chunk_timer = Utilities.PhaseTimer()
+        chunk_results = [pair_calculations for _, pair_calculations in
+                         iter_calculations(chunk_pairs, _CALCULATION_STATE['feds'], _CALCULATION_STATE['ref'], chunk_timer,
+                                           _CALCULATION_STATE['method'], _CALCULATION_STATE['validate'],
+                                           _CALCULATION_STATE['feds_lookup'], _CALCULATION_STATE['ref_lookup'],
+                                           None, _CALCULATION_STATE['resolution'])]
+        return chunk_results, chunk_timer.summary()
     
 def print_output(calculations, feds_polygons):
         """ print output using the _calculations var"""
@@ -83,10 +306,70 @@ def print_output(calculations, feds_polygons):
                 vals.append(calculations[key][i])
             print(f'CALCULATED A RESULT: POLYGON FEDS AT INDEX {calculations["index_pairs"][i][0]} AGAINST REFERENCE POLYGON AT INDEX {calculations["index_pairs"][i][1]}:')
             print(f'Ratio: {vals[0]}, Accuracy: {vals[1]}, Precision: {vals[2]}, Recall: {vals[3]}, IOU: {vals[4]}, F1 {vals[5]}, Symmetric Ratio: {vals[6]}')
-            print(f'All measurements in units {feds_polygons.crs.axis_info[0].unit_name}')
+            print(f'All measurements are dimensionless ratios of areas computed in {_areaUnits(feds_polygons)}')
                                  
         return
     
+def calculations_to_frame(calculations, feds_polygons):
+        """ typed columnar table of calculations, ready for write_calculations / dashboards
+            calculations: run_calculations dict or run_calculations_batched DataFrame
+            return: DataFrame with feds_index, ref_index (Int64), one Float64 column per metric
+                    (and confusion term when present), <NA> for unmatched pairs; table.attrs['units'] maps
+                    each value column to its unit: _areaUnits for AREA_KEYS columns, 'dimensionless' for ratios
+        """
+        
+        if isinstance(calculations, pd.DataFrame):
+            table = calculations.copy()
+        else:
+            table = pd.DataFrame({'feds_index': [feds_ref_pair[0] for feds_ref_pair in calculations['index_pairs']],
+                                  'ref_index': [feds_ref_pair[1] for feds_ref_pair in calculations['index_pairs']]})
+            for key in calculations:
+                if key != 'index_pairs':
+                    table[key] = pd.Series(calculations[key], dtype='object')
+        
+        table['feds_index'] = _nullableIds(table['feds_index'])
+        table['ref_index'] = _nullableIds(table['ref_index'])
+        for key in table.columns:
+            if key not in ['feds_index', 'ref_index']:
+                table[key] = pd.to_numeric(table[key]).astype('float64').astype('Float64')
+        # area terms are reported in the equal-area projection, metrics are ratios of them
+        table.attrs['units'] = {key: _areaUnits(feds_polygons) if key in AREA_KEYS else 'dimensionless'
+                                for key in table.columns if key not in ['feds_index', 'ref_index']}
+        
+        return table
+
+def write_calculations(table, path, chunk_rows=50000):
+        """ write a calculations_to_frame table to .parquet or .csv in chunks of chunk_rows
+            (parquet row groups / appended csv blocks), instead of printing every pair
+            parquet files carry table.attrs['units'] as JSON under the schema metadata key 'units'
+            return: path written
+        """
+        
+        extension = os.path.splitext(path)[1].lower()
+        
+        if extension in ['.parquet', '.pq']:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            
+            schema = pa.Schema.from_pandas(table, preserve_index=False)
+            if 'units' in table.attrs:
+                schema = schema.with_metadata({**(schema.metadata or {}), b'units': json.dumps(table.attrs['units']).encode('utf-8')})
+            with pq.ParquetWriter(path, schema) as writer:
+                for first in range(0, max(table.shape[0], 1), chunk_rows):
+                    block = table.iloc[first:first + chunk_rows]
+                    writer.write_table(pa.Table.from_pandas(block, schema=schema, preserve_index=False))
+                    
+        elif extension == '.csv':
+            with open(path, 'w', newline='') as csv_file:
+                for first in range(0, max(table.shape[0], 1), chunk_rows):
+                    table.iloc[first:first + chunk_rows].to_csv(csv_file, header=(first == 0), index=False)
+        
+        else:
+            raise Exception(f"Unsupported calculations output format {extension}; use .parquet or .csv")
+        
+        logging.info(f'Wrote {table.shape[0]} calculation rows to {path}')
+        return path
+    
 def areaCalculation(geom_instance):
         """ Calculate area of the object, including
             mult-row instances via loop
@@ -100,15 +383,230 @@ def areaCalculation(geom_instance):
             # FEDS_B: Area burned from FEDS; FRAP_UB: Unburned area from FRAP; 
             # FRAP_B: Burned area from FRAP; AREA_TOTAL: Total land area in CA
         """
-        try:
-            area = 0
-            for i in range(geom_instance.geometry.area.shape[0]):
-                area += geom_instance.geometry.area[i]
-        except KeyError:
-            # print('Identified key error in areaCalculation(): returning item() based area calc', end='\r')
-            area = geom_instance.geometry.area.item()
+        # one vectorized area pass over every row
+        return float(geom_instance.geometry.area.sum())
+
+def confusionMatrix(feds_inst, nifc_inst, method='algebra', validate=False, tolerance=1e-6, resolution=None):
+    """ Calculate every confusion term of a pair in one pass
+        the envelope is the single bounding box fitting both instances
+        method: 'algebra' (default) needs one intersection area + one envelope area:
+                    FP = FEDS_B - TP, FN = REF_B - TP, TN = AREA_TOTAL - FEDS_B - REF_B + TP
+                'overlay' builds every term from envelope/difference overlays
+                'raster' approximates TP on a grid of resolution cell size (see rasterConfusion)
+        validate: also run the overlay path and assert all terms agree within tolerance
+                  (relative to the envelope area); for 'raster', assert the exact TP lies within TP_ERROR
+
+        return: dict with TP, FP, FN, TN, FEDS_B, REF_B, AREA_TOTAL
+    """
+    if method == 'overlay':
+        return overlayConfusion(feds_inst, nifc_inst)
+    if method == 'raster':
+        confusion = rasterConfusion(feds_inst.geometry.unary_union,
+                                    nifc_inst.geometry.unary_union,
+                                    resolution,
+                                    areaCalculation(feds_inst),
+                                    areaCalculation(nifc_inst))
+        if validate:
+            exact_TP = confusionMatrix(feds_inst, nifc_inst)['TP']
+            allowed = confusion['TP_ERROR'] + tolerance * max(abs(confusion['AREA_TOTAL']), 1.0)
+            assert abs(exact_TP - confusion['TP']) <= allowed, f"Raster TP {confusion['TP']} outside error bound of exact {exact_TP}"
+        return confusion
+    assert method == 'algebra', f"Unknown confusion method {method}"
+
+    # sum area (since mul entries may exist) up by calc
+    confusion = confusionFromGeometries(feds_inst.geometry.unary_union,
+                                        nifc_inst.geometry.unary_union,
+                                        areaCalculation(feds_inst),
+                                        areaCalculation(nifc_inst))
+
+    if validate:
+        checked = overlayConfusion(feds_inst, nifc_inst)
+        allowed = tolerance * max(abs(checked['AREA_TOTAL']), 1.0)
+        for term in confusion:
+            assert abs(confusion[term] - checked[term]) <= allowed, f"Area algebra mismatch on {term}: {confusion[term]} vs overlay {checked[term]}"
+
+    return confusion
+
+def confusionFromGeometries(feds_geom, nifc_geom, feds_area=None, nifc_area=None):
+    """ area algebra confusion terms for two (multi)polygons
+        feds_area / nifc_area: burned areas when already known, otherwise taken from the geometries
+    """
+    if feds_area is None:
+        feds_area = feds_geom.area
+    if nifc_area is None:
+        nifc_area = nifc_geom.area
+
+    TP = feds_geom.intersection(nifc_geom).area
+
+    # envelope of both instances straight from their bounds
+    feds_minx, feds_miny, feds_maxx, feds_maxy = feds_geom.bounds
+    nifc_minx, nifc_miny, nifc_maxx, nifc_maxy = nifc_geom.bounds
+    AREA_TOTAL = ((max(feds_maxx, nifc_maxx) - min(feds_minx, nifc_minx)) *
+                  (max(feds_maxy, nifc_maxy) - min(feds_miny, nifc_miny)))
+
+    return {'TP': TP,
+            'FP': feds_area - TP,
+            'FN': nifc_area - TP,
+            'TN': AREA_TOTAL - feds_area - nifc_area + TP,
+            'FEDS_B': feds_area, 'REF_B': nifc_area, 'AREA_TOTAL': AREA_TOTAL}
+
+def rasterConfusion(feds_geom, nifc_geom, resolution=None, feds_area=None, nifc_area=None, cells=1024, max_cells=4096):
+    """ approximate confusion terms: both instances are burned onto one grid over their envelope
+        and TP is the count of cells burned by both; everything else follows the area algebra
+        resolution: cell size in CRS units; None fits cells cells along the longer envelope side
+        max_cells: cap on cells along the longer side; a finer resolution is coarsened to it
+        return: confusionFromGeometries terms plus TP_ERROR, the area of cells crossed by either
+                boundary (only those cells can be misclassified, so |TP - exact TP| <= TP_ERROR)
+    """
+    from rasterio import features, transform
+
+    if feds_area is None:
+        feds_area = feds_geom.area
+    if nifc_area is None:
+        nifc_area = nifc_geom.area
+
+    feds_minx, feds_miny, feds_maxx, feds_maxy = feds_geom.bounds
+    nifc_minx, nifc_miny, nifc_maxx, nifc_maxy = nifc_geom.bounds
+    minx, miny = min(feds_minx, nifc_minx), min(feds_miny, nifc_miny)
+    maxx, maxy = max(feds_maxx, nifc_maxx), max(feds_maxy, nifc_maxy)
+    AREA_TOTAL = (maxx - minx) * (maxy - miny)
+
+    longest_side = max(maxx - minx, maxy - miny)
+    if resolution is None:
+        resolution = longest_side / cells
+    if resolution < longest_side / max_cells:
+        logging.warning(f'Raster resolution {resolution} needs more than {max_cells} cells per side; coarsened to {longest_side / max_cells}')
+        resolution = longest_side / max_cells
+    if resolution <= 0:
+        # degenerate envelope: a single cell
+        resolution = 1.0
+    grid_shape = (max(1, math.ceil((maxy - miny) / resolution)), max(1, math.ceil((maxx - minx) / resolution)))
+    grid_transform = transform.from_origin(minx, maxy, resolution, resolution)
+
+    def burn(shapes, all_touched=False):
+        return features.rasterize(shapes, out_shape=grid_shape, transform=grid_transform,
+                                  fill=0, default_value=1, all_touched=all_touched, dtype='uint8').astype(bool)
+
+    cell_area = resolution * resolution
+    TP = float(np.count_nonzero(burn([feds_geom]) & burn([nifc_geom]))) * cell_area
+    TP_ERROR = float(np.count_nonzero(burn([feds_geom.boundary, nifc_geom.boundary], all_touched=True))) * cell_area
+
+    return {'TP': TP,
+            'FP': feds_area - TP,
+            'FN': nifc_area - TP,
+            'TN': AREA_TOTAL - feds_area - nifc_area + TP,
+            'FEDS_B': feds_area, 'REF_B': nifc_area, 'AREA_TOTAL': AREA_TOTAL,
+            'TP_ERROR': TP_ERROR}
+
+def overlayConfusion(feds_inst, nifc_inst):
+    """ confusionMatrix terms from overlays: each overlay runs once and is shared across terms """
+    # burned areas
+    feds_area = areaCalculation(feds_inst)
+    nifc_area = areaCalculation(nifc_inst)
+
+    # TP: basic intersection
+    intersection = gpd.overlay(feds_inst, nifc_inst, how='intersection')
+    TP = areaCalculation(intersection)
+
+    # envelope fitting both instances (even if multi-poly)
+    net_bounding = netBounding(feds_inst, nifc_inst)
+    AREA_TOTAL = areaCalculation(net_bounding)
+
+    # negatives of each instance inside the envelope
+    feds_neg = gpd.overlay(net_bounding, feds_inst, how='difference')
+    nifc_neg = gpd.overlay(net_bounding, nifc_inst, how='difference')
+
+    FN = areaCalculation(gpd.overlay(feds_neg, nifc_inst, keep_geom_type=False, how='intersection'))
+    FP = areaCalculation(gpd.overlay(nifc_neg, feds_inst, keep_geom_type=False, how='intersection'))
+    TN = areaCalculation(gpd.overlay(feds_neg, nifc_neg, keep_geom_type=False, how='intersection'))
 
-        return area
+    return {'TP': TP, 'FP': FP, 'FN': FN, 'TN': TN,
+            'FEDS_B': feds_area, 'REF_B': nifc_area, 'AREA_TOTAL': AREA_TOTAL}
+
+def netBounding(feds_inst, nifc_inst):
+    """ single row frame holding the bounding box fitting both instances
+        (one envelope over the union, not one per union piece)
+    """
+    unionr = gpd.overlay(feds_inst, nifc_inst, how='union')
+    return gpd.GeoDataFrame(geometry=[unionr.geometry.unary_union.envelope], crs=unionr.crs)
+
+def confusionArrays(feds_geoms, nifc_geoms, feds_area=None, nifc_area=None, symmetric_difference=False):
+    """ confusionFromGeometries element-wise over two aligned GeoSeries
+        feds_area / nifc_area: burned area arrays when already known
+        symmetric_difference: also overlay the actual symmetric difference (SYMM_DIFF); otherwise
+                              metricArrays derives it from TP, as metricsFromConfusion does
+        return: dict of float64 arrays: confusion terms (plus SYMM_DIFF if requested)
+    """
+    if feds_area is None:
+        feds_area = feds_geoms.area.values
+    if nifc_area is None:
+        nifc_area = nifc_geoms.area.values
+
+    TP = feds_geoms.intersection(nifc_geoms, align=False).area.values
+
+    # envelope fitting both instances, straight from the bounds arrays
+    feds_bounds = Utilities.bounds_array(feds_geoms)
+    nifc_bounds = Utilities.bounds_array(nifc_geoms)
+    AREA_TOTAL = ((np.maximum(feds_bounds[:, 2], nifc_bounds[:, 2]) - np.minimum(feds_bounds[:, 0], nifc_bounds[:, 0])) *
+                  (np.maximum(feds_bounds[:, 3], nifc_bounds[:, 3]) - np.minimum(feds_bounds[:, 1], nifc_bounds[:, 1])))
+
+    confusion = {'TP': TP,
+                 'FP': feds_area - TP,
+                 'FN': nifc_area - TP,
+                 'TN': AREA_TOTAL - feds_area - nifc_area + TP,
+                 'FEDS_B': feds_area, 'REF_B': nifc_area, 'AREA_TOTAL': AREA_TOTAL}
+    if symmetric_difference:
+        confusion['SYMM_DIFF'] = feds_geoms.symmetric_difference(nifc_geoms, align=False).area.values
+    return confusion
+
+def metricArrays(confusion):
+    """ metricsFromConfusion over confusionArrays output (NaN where a ratio is undefined)
+        symm_ratio uses SYMM_DIFF when it was overlaid, else the area burned by exactly one source
+        return: dict of float64 arrays keyed by METRIC_KEYS
+    """
+    TP, FP, FN, TN = confusion['TP'], confusion['FP'], confusion['FN'], confusion['TN']
+    feds_area, nifc_area = confusion['FEDS_B'], confusion['REF_B']
+    symm_diff = confusion['SYMM_DIFF'] if 'SYMM_DIFF' in confusion else feds_area + nifc_area - 2 * TP
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = TP / feds_area
+        recall = TP / nifc_area
+        return { 'ratio': feds_area / nifc_area,
+                 'accuracy': (TN + TP) / confusion['AREA_TOTAL'],
+                 'precision': precision,
+                 'recall': recall,
+                 'iou': TP / (TP + FP + FN),
+                 'f1': 2 * (precision*recall)/(precision+recall),
+                 'symm_ratio': symm_diff / nifc_area
+               }
+
+def metricsFromConfusion(confusion):
+    """ derive all run_calculations metrics from a confusionMatrix result
+        return: dict keyed by METRIC_KEYS (RASTER_KEYS for rasterConfusion terms)
+    """
+    TP, FP, FN, TN = confusion['TP'], confusion['FP'], confusion['FN'], confusion['TN']
+    feds_area, nifc_area = confusion['FEDS_B'], confusion['REF_B']
+
+    assert feds_area is not None, "None type detected for area; something went wrong"
+    assert nifc_area is not None, "None type detected for area; something went wrong"
+
+    precision = TP / feds_area
+    recall = TP / nifc_area
+
+    metrics = { 'ratio': feds_area / nifc_area,
+                'accuracy': (TN + TP) / confusion['AREA_TOTAL'],
+                'precision': precision,
+                'recall': recall,
+                'iou': TP / (TP + FP + FN),
+                'f1': 2 * (precision*recall)/(precision+recall),
+                # symmetric difference == burned by exactly one source
+                'symm_ratio': (feds_area + nifc_area - 2 * TP) / nifc_area
+              }
+    # approximate (raster) terms carry their error bound along
+    if 'TP_ERROR' in confusion:
+        metrics['tp_error'] = confusion['TP_ERROR']
+
+    return metrics
 
 def truePos(feds_inst, nifc_inst):
     """ Calculate true pos area:
@@ -124,14 +622,8 @@ def falseNeg(feds_inst, nifc_inst):
         NIFC burned but FEDS DID NOT burn (unburned needs envelope)
         make bounding -> get negative of Feds -> intersect with nifc (burning)
     """
-    # union to envelope 
-    unionr = gpd.overlay(feds_inst, nifc_inst, how='union')
-
     # generate bounding box fitting both instances (even if multi-poly)
-    net_bounding = unionr.geometry.envelope
-    # net_barea = areaCalculation(net_bounding)
-    # convert to data frame
-    net_bounding = net_bounding.to_frame()
+    net_bounding = netBounding(feds_inst, nifc_inst)
 
     feds_neg = gpd.overlay(net_bounding, feds_inst, how='difference')
     result = gpd.overlay(feds_neg, nifc_inst, keep_geom_type=False, how='intersection')
@@ -144,14 +636,8 @@ def falsePos(feds_inst, nifc_inst):
         NIFC DID NOT burn (unburned needs envelope) but FEDS burned 
         bounding -> get negative of nifc -> intersect with feds (burning)
     """
-    # union to envelope 
-    unionr = gpd.overlay(feds_inst, nifc_inst, how='union')
-
     # generate bounding box fitting both instances (even if multi-poly)
-    net_bounding = unionr.geometry.envelope
-    # net_barea = areaCalculation(net_bounding)
-    # convert to data frame
-    net_bounding = net_bounding.to_frame()
+    net_bounding = netBounding(feds_inst, nifc_inst)
 
     nifc_neg = gpd.overlay(net_bounding, nifc_inst, how='difference')
 
@@ -166,14 +652,8 @@ def trueNeg(feds_inst, nifc_inst):
         output: area where both agree of no geom
     """
 
-    # union to envelope 
-    unionr = gpd.overlay(feds_inst, nifc_inst, how='union')
-
     # generate bounding box fitting both instances (even if multi-poly)
-    net_bounding = unionr.geometry.envelope
-    net_barea = areaCalculation(net_bounding)
-    # convert to data frame
-    net_bounding = net_bounding.to_frame()
+    net_bounding = netBounding(feds_inst, nifc_inst)
 
     # subtract feds_inst and nifc_inst from bounding area
     feds_neg = gpd.overlay(net_bounding, feds_inst, how='difference')
@@ -189,13 +669,9 @@ def areaTotal(feds_inst, nifc_inst):
     """ Calculate total Area defined in table 6:	
         FEDS_B/REF_B(burned area)
     """
-    # union to envelope 
-    unionr = gpd.overlay(feds_inst, nifc_inst, how='union')
     # generate bounding box fitting both instances (even if multi-poly)
-    net_bounding = unionr.geometry.envelope
+    net_bounding = netBounding(feds_inst, nifc_inst)
     net_barea = areaCalculation(net_bounding)
-    # convert to data frame
-    # net_bounding = net_bounding.to_frame()
 
     return net_barea
 
@@ -260,7 +736,7 @@ def IOUCalculation(feds_inst, nifc_inst):
     FP = falsePos(feds_inst, nifc_inst) # feds + nifc agree on no burning
     FN = falseNeg(feds_inst, nifc_inst) # feds thinks unburned when nifc burned
 
-    return 0
+    return TP / (TP + FP + FN)
 
 def f1ScoreCalculation(feds_inst, nifc_inst):
     """ 2 * (Precision * Recall)/(Precision + Recall)
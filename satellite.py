@@ -16,6 +16,7 @@ import geopandas as gpd
 import datetime as dt
 from datetime import datetime, timedelta
 from functools import singledispatch
+from Utilities import bounds_array, cached_geometry_lookup, add_area_columns
 
 pd.set_option('display.max_columns',None)
 
@@ -65,6 +66,7 @@ class SatelliteDetection():
         self._range_stop = None
         self._polygons = None
         self._queryables = None
+        self._bounds = None
         
         # singleset up functions
         self.__set_up_master()
@@ -94,6 +96,25 @@ class SatelliteDetection():
     def polygons(self):
         return self._polygons
     
+    @property
+    def bounds(self):
+        """ (n, 4) float64 [minx, miny, maxx, maxy] per polygon; computed once, aligned with polygons rows """
+        if self._bounds is None and self._polygons is not None:
+            self._bounds = bounds_array(self._polygons)
+        return self._bounds
+    
+    @property
+    def geometry_by_id(self):
+        """ {'index' id: (geometry, equal area, equal-area geometry)} for constant time pair lookups; computed once
+            per polygons frame and reused by the metrics stage (see Utilities.cached_geometry_lookup) """
+        if self._polygons is None:
+            return None
+        return cached_geometry_lookup(self._polygons)
+    
+    @property
+    def apply_finalfire(self):
+        return self._apply_finalfire
+    
     @property
     def queryables(self):
         return self._queryables
@@ -202,7 +223,8 @@ class SatelliteDetection():
             sorted_gdf = df.sort_values(by=['fireid', 'index'], ascending=[True, False])
             df = sorted_gdf.drop_duplicates(subset='fireid', keep='first')
             
-        self._polygons = df
+        # equal-area per polygon areas computed once
+        self._polygons = add_area_columns(df)
         
         return self
     
\ No newline at end of file
@@ -7,6 +7,7 @@ DESCRIPTION: py for main search engine
 import glob
 import sys
 import logging
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import fsspec
@@ -18,6 +19,8 @@ import warnings
 warnings.filterwarnings('ignore')
 
 from pyproj import CRS
+from shapely.prepared import prep
+from concurrent.futures import ProcessPoolExecutor
 from owslib.ogcapi.features import Features
 from datetime import datetime, timedelta
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError, EndpointConnectionError
@@ -36,7 +39,29 @@ def init_search(year_start_in,
                 month_end_in,
                 day_end_in, 
                 full_search_region,
-                crs_in: 3857):
+                crs_in: 3857,
+                bulk=False,
+                workers=1,
+                shards=None,
+                checkpoint_path=None,
+                checkpoint_every=100,
+                stream=False,
+                timer=None):
+    """ run the feds -> reference search over the region/date range
+        bulk: if true, match all feds polygons in a single spatial join (see bulk_date_match)
+              instead of one closest_date_match call per feds polygon
+        workers: number of processes to split feds polygons across (1 runs in this process)
+        shards: optional (n_lon, n_lat) grid; the bbox is tiled and each tile is fetched + matched
+                independently (in parallel when workers > 1), see sharded_search
+        checkpoint_path: optional local file; progress is saved every checkpoint_every feds polygons
+                         and a rerun with the same arguments resumes after the last saved polygon
+                         (per polygon matching only; bulk and sharded runs are not checkpointed)
+        stream: if true, return a generator of (feds index, ref index) pairs in place of master_matches
+                (see iter_matched_pairs); polygons are still loaded up front, matching runs as it is consumed
+        timer: optional Utilities.PhaseTimer; filled with per phase wall time / call / row counts
+               (fetches, phase 1 intersections, phase 2 date matching...), read back with timer.summary()
+        returns: master_matches, all_aircraft_polygons, all_satellite_polygons
+    """
     
     import Utilities
     
@@ -69,21 +94,6 @@ def init_search(year_start_in,
     search_bbox = full_search_region #
    
     day_search_range = 7 # acceptable distance to search from feds -> reference (e.g. if refernce polygon is 8 days away, it is not included in calculations)
-
-    # SAT INPUT SETTINGS  # [Change to FEDS Input settings]
-    sat_title = "firenrt"
-    sat_collection =  "public.eis_fire_lf_perimeter_archive" # "public.eis_fire_lf_perimeter_nrt" 
-    sat_access_type = "api" # or "local
-    sat_limit = 9000 # amount of features to consider for FEDS API access; warning appears if it misses any entries
-    sat_filter = False # False or a valid query: e.g. "farea>5 AND duration>2"
-    sat_apply_finalfire = True # set this to true if you want the only the latest fireID to be taken per unique FireID
-
-    # AIRPLANE INPUT SETTINGS 
-    ref_title = "Downloaded_InterAgencyFirePerimeterHistory_All_Years_View" # "WFIGS_Interagency_Fire_Perimeters" # "nifc_interagency_history_local" # "InterAgencyFirePerimeterHistory_All_Years_View" 
-    ref_control_type = "defined" # or "custom"
-    ref_custom_url = "none" 
-    ref_custom_read_type = "none" 
-    ref_filter = False # False or a valid query
     
     # start date formatting
     search_start = Utilities.format_datetime(year_start, 
@@ -113,54 +123,460 @@ def init_search(year_start_in,
     print('You may see an ERROR 1 occur; ignore this unless block throws actual exception...')
     print('You may see WARNING:fiona.ogrext:Expecting property name enclosed in double quotes: line 1 column 2 (char 1); you can ignore this error safely')
 
+    if shards is not None:
+        assert not stream, "ERR: streaming results is not supported for sharded searches"
+        return sharded_search(search_start, search_stop, search_bbox, crs, shards, workers, bulk, day_search_range, timer)
+
     # generate massive feds pull
-    sat_fire_collection = SatelliteDetection(
-                         sat_title, 
-                         sat_collection, 
-                         search_start,
-                         search_stop,
-                         search_bbox,
-                         crs,
-                         sat_access_type,
-                         sat_limit,
-                         sat_filter,
-                         sat_apply_finalfire
-                        )
-    
-    air_fire_collection = AircraftDetection( 
-                 search_start,
-                 search_stop,
-                 search_bbox,
-                 crs,
-                 ref_title,
-                 ref_control_type,
-                 ref_custom_url,
-                 ref_custom_read_type,
-                 ref_filter,
-                )
+    sat_fire_collection, air_fire_collection = load_collections(search_start, search_stop, search_bbox, crs, timer)
 
     all_aircraft_polygons = air_fire_collection.polygons
     all_satellite_polygons = sat_fire_collection.polygons 
     
+    if stream:
+        matched_pairs = iter_matched_pairs(all_satellite_polygons, all_aircraft_polygons, bulk, workers, day_search_range,
+                                           sat_fire_collection.bounds, air_fire_collection.bounds, timer)
+        return matched_pairs, all_aircraft_polygons, all_satellite_polygons
+    
+    run_key = None
+    if checkpoint_path is not None:
+        run_key = Utilities.checkpoint_key(search_start, search_stop, search_bbox, str(crs), day_search_range,
+                                           all_satellite_polygons.shape[0], all_aircraft_polygons.shape[0])
+    
+    master_matches = match_polygons(all_satellite_polygons, all_aircraft_polygons, bulk, workers, day_search_range,
+                                    checkpoint_path, checkpoint_every, run_key,
+                                    sat_fire_collection.bounds, air_fire_collection.bounds, timer)
+    
+    return master_matches, all_aircraft_polygons, all_satellite_polygons
+
+
+def load_collections(search_start, search_stop, search_bbox, crs, timer=None):
+    """ fetch feds + reference collections for formatted start/stop dates and a [lon, lat, lon, lat] bbox
+        timer: optional Utilities.PhaseTimer, records 'feds_fetch' + 'reference_fetch'
+        returns: (SatelliteDetection, AircraftDetection)
+    """
+    
+    return load_feds(search_start, search_stop, search_bbox, crs, timer), load_references(search_start, search_stop, search_bbox, crs, timer)
+
+
+def load_feds(search_start, search_stop, search_bbox, crs, timer=None):
+    """ fetch the feds collection; timer records 'feds_fetch'
+        returns: SatelliteDetection
+    """
+
+    # SAT INPUT SETTINGS  # [Change to FEDS Input settings]
+    sat_title = "firenrt"
+    sat_collection =  "public.eis_fire_lf_perimeter_archive" # "public.eis_fire_lf_perimeter_nrt" 
+    sat_access_type = "api" # or "local
+    sat_limit = 9000 # amount of features to consider for FEDS API access; warning appears if it misses any entries
+    sat_filter = False # False or a valid query: e.g. "farea>5 AND duration>2"
+    sat_apply_finalfire = True # set this to true if you want the only the latest fireID to be taken per unique FireID
+
+    with Utilities.timed(timer, 'feds_fetch'):
+        sat_fire_collection = SatelliteDetection(
+                             sat_title, 
+                             sat_collection, 
+                             search_start,
+                             search_stop,
+                             search_bbox,
+                             crs,
+                             sat_access_type,
+                             sat_limit,
+                             sat_filter,
+                             sat_apply_finalfire
+                            )
+    
+    if timer is not None:
+        timer.add_rows('feds_fetch', _row_count(sat_fire_collection.polygons))
+    
+    return sat_fire_collection
+
+
+def load_references(search_start, search_stop, search_bbox, crs, timer=None):
+    """ fetch the reference collection; timer records 'reference_fetch'
+        returns: AircraftDetection
+    """
+    
+    # AIRPLANE INPUT SETTINGS 
+    ref_title = "Downloaded_InterAgencyFirePerimeterHistory_All_Years_View" # "WFIGS_Interagency_Fire_Perimeters" # "nifc_interagency_history_local" # "InterAgencyFirePerimeterHistory_All_Years_View" 
+    ref_control_type = "defined" # or "custom"
+    ref_custom_url = "none" 
+    ref_custom_read_type = "none" 
+    ref_filter = False # False or a valid query
+    
+    with Utilities.timed(timer, 'reference_fetch'):
+        air_fire_collection = AircraftDetection( 
+                     search_start,
+                     search_stop,
+                     search_bbox,
+                     crs,
+                     ref_title,
+                     ref_control_type,
+                     ref_custom_url,
+                     ref_custom_read_type,
+                     ref_filter,
+                    )
+    
+    if timer is not None:
+        timer.add_rows('reference_fetch', _row_count(air_fire_collection.polygons))
+    
+    return air_fire_collection
+
+
+def match_polygons(all_satellite_polygons, all_aircraft_polygons, bulk=False, workers=1, day_search_range=7,
+                   checkpoint_path=None, checkpoint_every=100, run_key=None, feds_bounds=None, ref_bounds=None,
+                   timer=None):
+    """ match every feds polygon to its best reference polygon
+        checkpoint_path: optional file to save/resume master_matches from (see init_search)
+        run_key: identifies the run the checkpoint belongs to
+        feds_bounds, ref_bounds: optional cached bounds arrays (SatelliteDetection.bounds / AircraftDetection.bounds)
+        timer: optional Utilities.PhaseTimer
+        returns: master_matches [[(feds iloc index, ref index or None)], ...]
+    """
+    
+    with Utilities.timed(timer, 'matching', all_satellite_polygons.shape[0]):
+        return _match_polygons(all_satellite_polygons, all_aircraft_polygons, bulk, workers, day_search_range,
+                               checkpoint_path, checkpoint_every, run_key, feds_bounds, ref_bounds, timer)
+
+def _match_polygons(all_satellite_polygons, all_aircraft_polygons, bulk, workers, day_search_range,
+                    checkpoint_path, checkpoint_every, run_key, feds_bounds, ref_bounds, timer):
+    """ match_polygons body, timed as a whole by the caller """
+    
+    if bulk:
+        return bulk_date_match(all_satellite_polygons, all_aircraft_polygons, day_search_range, timer)
+    
     # mass list: maps index of satellite fire to best aircraft match
     master_matches = []
     
+    if checkpoint_path is not None:
+        resumed = Utilities.load_checkpoint(checkpoint_path, run_key)
+        if resumed is not None:
+            master_matches = resumed
+            logging.info(f'Resuming from checkpoint {checkpoint_path}: {len(master_matches)} FEDS polygons already matched')
+    
     # iterate through result
-    for index in range(all_satellite_polygons.shape[0]):
-        # fetch corresponding fire
-        sat_fire = all_satellite_polygons.iloc[[index]]
-        
-        # matches returns shapes that intersect with the satellite + are within day_search_range bounding
-        # index: (sat index, ref_polygon index)
-        matched = closest_date_match(sat_fire, all_satellite_polygons, all_aircraft_polygons, index)
+    # matches returns shapes that intersect with the satellite + are within day_search_range bounding
+    # index: (sat index, ref_polygon index)
+    start = len(master_matches)
+    for index, matched in enumerate(iter_date_matches(all_satellite_polygons, all_aircraft_polygons, workers, start=start,
+                                                         feds_bounds=feds_bounds, ref_bounds=ref_bounds, timer=timer), start):
         assert matched[0][0] == index, f"Critical error; sat_fire index should have been manually confirmed: expected {index} but got {matched[0]}. Full matched: {matched}"
         master_matches.append(matched)
+        
+        if checkpoint_path is not None and (index + 1) % checkpoint_every == 0:
+            Utilities.save_checkpoint(checkpoint_path, run_key, master_matches)
     
+    if checkpoint_path is not None:
+        Utilities.save_checkpoint(checkpoint_path, run_key, master_matches)
+    
+    return master_matches
+
+
+def shard_bbox(search_bbox, shards):
+    """ tile a [lon, lat, lon, lat] bbox (str entries) into an n_lon x n_lat grid
+        returns: list of bboxes in the same str format, row by row from the south west corner
+    """
+    n_lon, n_lat = shards
+    assert n_lon >= 1 and n_lat >= 1, f"ERR: invalid shard grid {shards}"
+    
+    min_lon, min_lat, max_lon, max_lat = map(float, search_bbox)
+    lons = np.linspace(min_lon, max_lon, n_lon + 1)
+    lats = np.linspace(min_lat, max_lat, n_lat + 1)
+    
+    return [[str(lons[i]), str(lats[j]), str(lons[i + 1]), str(lats[j + 1])]
+            for j in range(n_lat) for i in range(n_lon)]
+
+
+def sharded_search(search_start, search_stop, search_bbox, crs, shards, workers=1, bulk=False, day_search_range=7, timer=None):
+    """ fetch feds per bbox shard, merge, then match each shard's feds against its slice of the references
+        feds polygons straddling shard edges are returned by several shards; the first copy is kept, and
+        with finalfire on only the latest perimeter per fireid survives the merge
+        references are loaded once here; each shard is only handed the references within its feds extent
+        merged feds polygons get a fresh 'index' col (per-shard api indices collide)
+        timer: optional Utilities.PhaseTimer; per shard timings are merged into it
+        returns: master_matches, all_aircraft_polygons, all_satellite_polygons
+    """
+    
+    tiles = shard_bbox(search_bbox, shards)
+    
+    # FEDS: fetch every shard
+    fetch_results = _map_shards(_fetch_shard, [(search_start, search_stop, tile, crs) for tile in tiles], workers)
+    if timer is not None:
+        for result in fetch_results:
+            timer.merge(result[2])
+    
+    all_satellite_polygons, shard_ids = _merge_shard_feds(fetch_results)
+    assert all_satellite_polygons.shape[0] != 0, f"ERR: no FEDS polygons found in any shard of {search_bbox}"
+    
+    # REFERENCES: one read, sliced per shard
+    all_aircraft_polygons = load_references(search_start, search_stop, search_bbox, crs, timer).polygons
+    match_args = []
+    for shard in np.unique(shard_ids):
+        shard_feds = all_satellite_polygons[shard_ids == shard]
+        # any reference intersecting a shard feds polygon lies within the feds extent
+        xmin, ymin, xmax, ymax = shard_feds.total_bounds
+        match_args.append((shard_feds, all_aircraft_polygons.cx[xmin:xmax, ymin:ymax], bulk, day_search_range))
+    match_results = _map_shards(_match_shard, match_args, workers)
+    
+    # scatter shard matches back to merged feds positions
+    master_matches = [None] * all_satellite_polygons.shape[0]
+    for shard, (shard_matches, shard_timings) in zip(np.unique(shard_ids), match_results):
+        if timer is not None:
+            timer.merge(shard_timings)
+        for position, matched in zip(np.flatnonzero(shard_ids == shard), shard_matches):
+            master_matches[position] = [(position, matched[0][1])]
+    
+    logging.info(f'Sharded search complete: {len(tiles)} shards, {all_satellite_polygons.shape[0]} unique FEDS polygons')
     return master_matches, all_aircraft_polygons, all_satellite_polygons
 
 
-def closest_date_match(sat_fire, all_satellite_polygons, all_aircraft_fires, index):
-        """ given the feds and reference polygons -> return list mapping the feds input to closest reference polygons"""
+def _map_shards(shard_func, shard_args, workers):
+    """ shard_func over every shard's args, in a process pool when workers > 1 (shard order kept) """
+    
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shard_args))) as pool:
+            return list(pool.map(shard_func, *zip(*shard_args)))
+    return [shard_func(*args) for args in shard_args]
+
+
+def _merge_shard_feds(fetch_results):
+    """ concat shard feds in shard order, drop copies of the same perimeter and, with finalfire on,
+        re-apply latest perimeter per fireid across shards (latest 't', earlier shard on ties)
+        returns: (merged feds with a fresh 'index' col, shard number per merged row)
+    """
+    
+    fetched = [(shard, result[0]) for shard, result in enumerate(fetch_results) if result[0] is not None and not result[0].empty]
+    if len(fetched) == 0:
+        return gpd.GeoDataFrame(), np.array([], dtype=int)
+    
+    merged_feds = pd.concat([shard_feds for _, shard_feds in fetched], ignore_index=True)
+    shard_ids = np.concatenate([np.full(shard_feds.shape[0], shard) for shard, shard_feds in fetched])
+    
+    dedup_key = pd.DataFrame({'wkb': [geom.wkb if geom is not None else None for geom in merged_feds.geometry.values]})
+    for col in ['t', 'fireid']:
+        if col in merged_feds.columns:
+            dedup_key[col] = merged_feds[col].values
+    keep = ~dedup_key.duplicated(keep='first').values
+    
+    # a fire crossing a shard edge can keep an older perimeter in one shard; only the latest survives
+    if any(result[1] for result in fetch_results) and 'fireid' in merged_feds.columns:
+        order = ['fireid', 't'] if 't' in merged_feds.columns else ['fireid']
+        candidates = merged_feds[keep].sort_values(by=order, ascending=[True] + [False] * (len(order) - 1), kind='stable')
+        latest = np.zeros(keep.shape[0], dtype=bool)
+        latest[candidates.drop_duplicates(subset='fireid', keep='first').index.values] = True
+        keep &= latest
+    
+    all_satellite_polygons = gpd.GeoDataFrame(merged_feds[keep].reset_index(drop=True), crs=merged_feds.crs)
+    all_satellite_polygons['index'] = all_satellite_polygons.index
+    return all_satellite_polygons, shard_ids[keep]
+
+
+def _fetch_shard(search_start, search_stop, shard_box, crs):
+    """ fetch one shard's feds polygons
+        returns: (shard feds, finalfire applied, shard timer summary)
+    """
+    
+    shard_timer = Utilities.PhaseTimer()
+    sat_fire_collection = load_feds(search_start, search_stop, shard_box, crs, shard_timer)
+    return sat_fire_collection.polygons, sat_fire_collection.apply_finalfire, shard_timer.summary()
+
+
+def _match_shard(shard_feds, shard_refs, bulk, day_search_range):
+    """ match one shard's feds against its reference slice
+        returns: (shard matches, shard timer summary)
+    """
+    
+    shard_timer = Utilities.PhaseTimer()
+    shard_matches = match_polygons(shard_feds.reset_index(drop=True), shard_refs, bulk, 1, day_search_range, timer=shard_timer)
+    return shard_matches, shard_timer.summary()
+
+
+def _row_count(polygons):
+    """ rows in a (possibly missing) polygon frame """
+    return 0 if polygons is None else polygons.shape[0]
+
+
+def iter_matched_pairs(all_satellite_polygons, all_aircraft_polygons, bulk=False, workers=1, day_search_range=7,
+                       feds_bounds=None, ref_bounds=None, timer=None):
+    """ generator of (feds index, ref index) pairs, yielded as each feds polygon is matched
+        feds index is the feds 'index' col value (as in the notebooks' final_index_pairs), so pairs
+        can go straight to calculations.iter_calculations; unmatched feds polygons yield (feds index, None)
+    """
+    
+    feds_ids = all_satellite_polygons['index'].values
+    
+    if bulk:
+        matches = bulk_date_match(all_satellite_polygons, all_aircraft_polygons, day_search_range, timer)
+    else:
+        matches = iter_date_matches(all_satellite_polygons, all_aircraft_polygons, workers,
+                                    feds_bounds=feds_bounds, ref_bounds=ref_bounds, timer=timer)
+    
+    for index, matched in enumerate(matches):
+        assert matched[0][0] == index, f"Critical error; sat_fire index should have been manually confirmed: expected {index} but got {matched[0]}. Full matched: {matched}"
+        yield (feds_ids[index], matched[0][1])
+
+
+def iter_date_matches(all_satellite_polygons, all_aircraft_polygons, workers=1, chunk_size=None, start=0,
+                      feds_bounds=None, ref_bounds=None, timer=None):
+        """ yield closest_date_match results for every feds polygon from position start on, in feds order
+                workers: > 1 splits feds polygons into chunks matched in a process pool;
+                         polygon frames are shipped once per worker process, not per chunk
+                chunk_size: feds polygons per pool task (defaults to ~4 tasks per worker)
+                start: first feds position to match (earlier positions are skipped, e.g. on resume)
+                feds_bounds, ref_bounds: cached Utilities.bounds_array of each frame (computed here if not passed)
+                timer: optional Utilities.PhaseTimer; pooled workers time their chunks and the summaries are merged in
+        """
+        
+        feds_count = all_satellite_polygons.shape[0]
+        if feds_bounds is None:
+            feds_bounds = Utilities.bounds_array(all_satellite_polygons)
+        if ref_bounds is None:
+            ref_bounds = Utilities.bounds_array(all_aircraft_polygons)
+        
+        if workers <= 1:
+            # spatial index + date buckets over reference polygons; built once and shared by every feds lookup
+            ref_sindex = all_aircraft_polygons.sindex
+            date_buckets = build_date_buckets(all_aircraft_polygons)
+            for index in range(start, feds_count):
+                # fetch corresponding fire
+                sat_fire = all_satellite_polygons.iloc[[index]]
+                yield closest_date_match(sat_fire, all_satellite_polygons, all_aircraft_polygons, index, ref_sindex, date_buckets,
+                                         ref_bounds, feds_bounds[index], timer)
+            return
+        
+        if chunk_size is None:
+            chunk_size = max(1, -(-(feds_count - start) // (workers * 4)))
+        chunks = [range(first, min(first + chunk_size, feds_count)) for first in range(start, feds_count, chunk_size)]
+        
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_match_worker,
+                                 initargs=(all_satellite_polygons, all_aircraft_polygons, feds_bounds, ref_bounds)) as pool:
+            # map keeps submission order, so feds order is preserved
+            for chunk_matches, chunk_timings in pool.map(_match_chunk, chunks):
+                if timer is not None:
+                    timer.merge(chunk_timings)
+                yield from chunk_matches
+
+
+# per-process state for pooled matching; filled once per worker by _init_match_worker
+_MATCH_STATE = {}
+
+def _init_match_worker(all_satellite_polygons, all_aircraft_polygons, feds_bounds, ref_bounds):
+        """ pool initializer: keep polygon frames + reference lookups for the worker lifetime """
+        warnings.filterwarnings('ignore')
+        _MATCH_STATE['feds'] = all_satellite_polygons
+        _MATCH_STATE['ref'] = all_aircraft_polygons
+        _MATCH_STATE['ref_sindex'] = all_aircraft_polygons.sindex
+        _MATCH_STATE['date_buckets'] = build_date_buckets(all_aircraft_polygons)
+        _MATCH_STATE['feds_bounds'] = feds_bounds
+        _MATCH_STATE['ref_bounds'] = ref_bounds
+
+def _match_chunk(positions):
+        """ pool task: closest_date_match for a chunk of feds positions
+            returns: (chunk matches, chunk timer summary)
+        """
+        feds = _MATCH_STATE['feds']
+        ref = _MATCH_STATE['ref']
+        chunk_timer = Utilities.PhaseTimer()
+        chunk_matches = [closest_date_match(feds.iloc[[index]], feds, ref, index, _MATCH_STATE['ref_sindex'], _MATCH_STATE['date_buckets'],
+                                            _MATCH_STATE['ref_bounds'], _MATCH_STATE['feds_bounds'][index], chunk_timer)
+                         for index in positions]
+        return chunk_matches, chunk_timer.summary()
+
+
+def bulk_date_match(all_satellite_polygons, all_aircraft_polygons, dayrange: int = 7, timer=None):
+        """ vectorized equivalent of calling closest_date_match on every feds polygon
+                all_satellite_polygons: feds polygons (needs 't' col)
+                all_aircraft_polygons: reference polygons (needs 'DATE_CUR_STAMP' + 'index' cols)
+                dayrange: acceptable day distance from feds -> reference
+                timer: optional Utilities.PhaseTimer, records 'bulk_match' (rows = candidate pairs)
+            returns: master_matches list, same structure as init_search [[(feds iloc index, ref index or None)], ...]
+        """
+        
+        with Utilities.timed(timer, 'bulk_match'):
+            master_matches, pair_count = _bulk_date_match(all_satellite_polygons, all_aircraft_polygons, dayrange)
+        if timer is not None:
+            timer.add_rows('bulk_match', pair_count)
+        
+        return master_matches
+
+def _bulk_date_match(all_satellite_polygons, all_aircraft_polygons, dayrange):
+        """ bulk_date_match body; returns (master_matches, candidate pair count) """
+        
+        feds_count = all_satellite_polygons.shape[0]
+        ref_ids = all_aircraft_polygons['index'].values
+        
+        # PHASE 1: ALL INTERSECTING PAIRS IN ONE SPATIAL JOIN (positional indices on both sides)
+        feds_geoms = gpd.GeoDataFrame({'feds_pos': np.arange(feds_count)},
+                                      geometry=all_satellite_polygons.geometry.values, crs=all_satellite_polygons.crs)
+        ref_geoms = gpd.GeoDataFrame({'ref_pos': np.arange(all_aircraft_polygons.shape[0])},
+                                     geometry=all_aircraft_polygons.geometry.values, crs=all_aircraft_polygons.crs)
+        joined = gpd.sjoin(feds_geoms, ref_geoms, how='inner', predicate='intersects')
+        pairs = pd.DataFrame({'feds_pos': joined['feds_pos'].values, 'ref_pos': joined['ref_pos'].values})
+        
+        # overlay keeps polygonal output only: drop pairs that only share an edge/point
+        left = gpd.GeoSeries(feds_geoms.geometry.values[pairs['feds_pos'].values])
+        right = gpd.GeoSeries(ref_geoms.geometry.values[pairs['ref_pos'].values])
+        pairs = pairs[~left.touches(right).values]
+        pairs = pairs.sort_values(['feds_pos', 'ref_pos']).reset_index(drop=True)
+        
+        # PHASE 2: NEAREST REFERENCE DATE PER FEDS POLYGON
+        feds_stamps = pd.to_datetime(all_satellite_polygons['t'], format="%Y-%m-%dT%H:%M:%S", errors='coerce').values
+        ref_stamps = pd.to_datetime(all_aircraft_polygons['DATE_CUR_STAMP']).values
+        pairs['feds_t'] = feds_stamps[pairs['feds_pos'].values]
+        pairs['ref_t'] = ref_stamps[pairs['ref_pos'].values]
+        
+        bad_stamps = pairs['feds_t'].isna()
+        if bad_stamps.any():
+            logging.warning(f'{pairs.loc[bad_stamps, "feds_pos"].nunique()} FEDS POLYGONS HAVE UNREADABLE TIMESTAMPS: ATTACHING NONE FOR REFERENCE INDEX')
+            pairs = pairs[~bad_stamps]
+        
+        if pairs.empty:
+            logging.warning(f'NO MATCHES FOUND FOR ANY OF {feds_count} FEDS POLYGONS; ATTACHING NONE FOR REFERENCE INDEX')
+            return [[(index, None)] for index in range(feds_count)], 0
+        
+        pairs['delta'] = (pairs['feds_t'] - pairs['ref_t']).abs()
+        grouped = pairs.groupby('feds_pos', sort=True)
+        nearest = pairs[pairs['delta'] == grouped['delta'].transform('min')]
+        # equal distances resolve to the later date, as in nearest_stamps
+        best_date = nearest.groupby('feds_pos')['ref_t'].max()
+        best_gap = nearest.groupby('feds_pos')['delta'].first()
+        pairs['best_t'] = pairs['feds_pos'].map(best_date)
+        
+        first_intersect = grouped['ref_pos'].first()
+        first_best = pairs[pairs['ref_t'] == pairs['best_t']].groupby('feds_pos')['ref_pos'].first()
+        
+        # window check on real time deltas, matching get_nearest_by_date
+        outside = (best_gap.loc[first_best.index] > pd.Timedelta(days=dayrange)).values
+        
+        chosen = first_best.copy()
+        if dayrange == 7:
+            # failing window: use first intersection as value
+            chosen[outside] = first_intersect.loc[first_best.index[outside]].values
+        else:
+            chosen = chosen[~outside]
+        
+        if outside.any():
+            logging.warning(f'{outside.sum()} FEDS POLYGONS HAVE NO REFERENCE DATE WITHIN {dayrange} DAYS')
+        
+        # PHASE 3: FLATTEN INTO MASTER MATCHES
+        ref_lookup = dict(zip(chosen.index.values, ref_ids[chosen.values]))
+        master_matches = [[(index, ref_lookup.get(index))] for index in range(feds_count)]
+        
+        logging.info(f'Bulk matching complete: {len(ref_lookup)} of {feds_count} FEDS polygons matched')
+        return master_matches, pairs.shape[0]
+
+
+def closest_date_match(sat_fire, all_satellite_polygons, all_aircraft_fires, index, ref_sindex=None, date_buckets=None,
+                       ref_bounds=None, feds_bounds=None, timer=None):
+        """ given the feds and reference polygons -> return list mapping the feds input to closest reference polygons
+            ref_sindex: optional prebuilt spatial index of all_aircraft_fires (defaults to the frame's cached sindex)
+            date_buckets: optional build_date_buckets(all_aircraft_fires); geometry tests then run on references
+                          inside the day window first, and on all references only if none of those intersect
+            ref_bounds: optional (n, 4) bounds array of all_aircraft_fires, feds_bounds: bounds of sat_fire;
+                        windowed candidates are rejected on envelopes before any shapely predicate
+            timer: optional Utilities.PhaseTimer, records 'phase1_intersections' + 'phase2_date_match'
+        """
         
         # store as (feds_poly index, ref_polygon index)
         matches = []
@@ -173,11 +589,23 @@ def closest_date_match(sat_fire, all_satellite_polygons, all_aircraft_fires, ind
         ref_polygons = all_aircraft_fires
 
         # PHASE 1: FIND INTERSECTIONS OF ANY KIND
-        for ref_poly_i in range(ref_polygons.shape[0]):
-            curr_ref_poly = ref_polygons.iloc[[ref_poly_i]]
-            intersect = gpd.overlay(curr_ref_poly, curr_feds_poly, how='intersection')
-            if not intersect.empty:
-                curr_finds.append(ref_poly_i)
+        with Utilities.timed(timer, 'phase1_intersections'):
+            # feds geometry prepared once, shared by the windowed and fallback searches
+            prepared = prepared_geometry(curr_feds_poly)
+            # references in the day window hold the nearest date whenever any of them intersect
+            window = None
+            if date_buckets is not None:
+                try:
+                    window = date_window_positions(date_buckets, datetime.strptime(curr_feds_poly.t.values[0], "%Y-%m-%dT%H:%M:%S"), 7)
+                except Exception as e:
+                    logging.warning(f'Unable to bucket FEDS poly with index {index} by date ({e}); testing all references')
+            
+            if window is not None and window.shape[0] != 0:
+                curr_finds = find_intersecting(curr_feds_poly, ref_polygons, ref_sindex, window, ref_bounds, feds_bounds, prepared)
+            if len(curr_finds) == 0:
+                curr_finds = find_intersecting(curr_feds_poly, ref_polygons, ref_sindex, prepared=prepared)
+        if timer is not None:
+            timer.add_rows('phase1_intersections', len(curr_finds))
 
         if len(curr_finds) == 0:
             # for later calculations, this feds polygon is not paired with any ref poly
@@ -192,8 +620,9 @@ def closest_date_match(sat_fire, all_satellite_polygons, all_aircraft_fires, ind
 
         # PHASE 2: GET BEST TIME STAMP SET, TEST IF INTERSECTIONS FIT THIS BEST DATE
         try:
-            timestamp = datetime.strptime(timestamp.values[0], "%Y-%m-%dT%H:%M:%S")
-            time_matches = get_nearest_by_date(set_up_finds, timestamp, 7)
+            with Utilities.timed(timer, 'phase2_date_match', set_up_finds.shape[0]):
+                timestamp = datetime.strptime(timestamp.values[0], "%Y-%m-%dT%H:%M:%S")
+                time_matches = get_nearest_by_date(set_up_finds, timestamp, 7, timer=timer)
         except Exception as e:
             logging.error(f'Encountered error when running get_nearest_by_date: {e}')
             logging.warning(f'DUE TO ERR: FEDS POLY WITH INDEX {index} HAS NO INTERSECTIONS AT BEST DATES:  ATTACHING NONE FOR REFERENCE INDEX')
@@ -219,29 +648,141 @@ def closest_date_match(sat_fire, all_satellite_polygons, all_aircraft_fires, ind
         return matches
     
     
-def get_nearest_by_date(dataset, timestamp, dayrange: int):
+def get_nearest_by_date(dataset, timestamp, dayrange: int, time_index=None, timer=None):
         """ Identify rows of dataset with timestamp matches;
             expects year, month, date in datetime format
                 dataset: input dataset to search for closest match
                 timestamp: timestamp we want a close match for
+                dayrange: max days between timestamp and the closest match
+                time_index: optional (sorted_stamps, order) from build_time_index(dataset)
+                timer: optional Utilities.PhaseTimer, records 'nearest_by_date' (rows = dataset rows searched)
             returns: dataset with d->m->y closest matches
         """
+        
+        with Utilities.timed(timer, 'nearest_by_date', dataset.shape[0]):
+            return _get_nearest_by_date(dataset, timestamp, dayrange, time_index)
+
+def _get_nearest_by_date(dataset, timestamp, dayrange, time_index):
+        """ get_nearest_by_date body """
 
-        # timestamp = timestamp.item()
-        transformed = dataset.DATE_CUR_STAMP.tolist() # TODO: deal with this label? or make sure ref sets always have this
-        clos_dict = {
-          abs(timestamp.timestamp() - date.timestamp()) : date
-          for date in transformed
-        }
+        if time_index is None:
+            time_index = build_time_index(dataset) # TODO: deal with this label? or make sure ref sets always have this
+        sorted_stamps, order = time_index
 
-        res = clos_dict[min(clos_dict.keys())]
+        query = pd.Timestamp(timestamp).value
+        res = nearest_stamps(sorted_stamps, np.array([query], dtype='int64'))[0]
+        gap = abs(int(res) - query)
+        window = pd.Timedelta(days=dayrange).value
 
         # check on dayrange flexibility - trigger outer exception if failing
-        if abs(timestamp.day - res.day) > dayrange and dayrange == 7:
+        if gap > window and dayrange == 7:
             return None
 
-        assert abs(timestamp.day - res.day) <= dayrange, "FATAL: No dates found in specified range; try a more flexible range by adjusting `dayrange` var"
-        # fetch rows with res timestamp
-        finalized = dataset[dataset['DATE_CUR_STAMP'] == res]
+        assert gap <= window, "FATAL: No dates found in specified range; try a more flexible range by adjusting `dayrange` var"
+        # fetch rows with res timestamp: one contiguous run of the sorted index, kept in dataset order
+        lo = np.searchsorted(sorted_stamps, res, side='left')
+        hi = np.searchsorted(sorted_stamps, res, side='right')
+        finalized = dataset.take(np.sort(order[lo:hi]))
+
+        return finalized
+
+
+def build_date_buckets(dataset):
+        """ bucket dataset rows by calendar day of DATE_CUR_STAMP
+            returns: ({datetime64[D]: ascending positions}, int64 epoch (ns) stamp per row)
+        """
+        stamps = pd.to_datetime(dataset['DATE_CUR_STAMP']).values.astype('datetime64[ns]')
+        days = stamps.astype('datetime64[D]')
+        
+        order = np.argsort(days, kind='stable')
+        bucket_days, starts = np.unique(days[order], return_index=True)
+        buckets = dict(zip(bucket_days, np.split(order, starts[1:])))
+        
+        return buckets, stamps.astype('int64')
 
-        return finalized
\ No newline at end of file
+
+def date_window_positions(date_buckets, timestamp, dayrange: int):
+        """ ascending positions of bucketed rows within dayrange days of timestamp """
+        buckets, stamps = date_buckets
+        
+        query = pd.Timestamp(timestamp).value
+        window = pd.Timedelta(days=dayrange).value
+        first_day = np.datetime64(query - window, 'ns').astype('datetime64[D]')
+        last_day = np.datetime64(query + window, 'ns').astype('datetime64[D]')
+        
+        day_positions = [buckets[day] for day in np.arange(first_day, last_day + 1) if day in buckets]
+        if len(day_positions) == 0:
+            return np.empty(0, dtype='int64')
+        
+        positions = np.concatenate(day_positions)
+        positions = positions[np.abs(stamps[positions] - query) <= window]
+        
+        return np.sort(positions)
+
+
+def build_time_index(dataset):
+        """ sorted int64 epoch (ns) array of dataset.DATE_CUR_STAMP
+            returns: (sorted_stamps, order) where order maps sorted position -> dataset position
+        """
+        stamps = pd.to_datetime(dataset['DATE_CUR_STAMP']).values.astype('datetime64[ns]').astype('int64')
+        order = np.argsort(stamps, kind='stable')
+        return stamps[order], order
+
+
+def nearest_stamps(sorted_stamps, queries):
+        """ batched nearest lookup by binary search
+                sorted_stamps: ascending int64 epoch array (see build_time_index)
+                queries: int64 epoch array of timestamps to resolve
+            returns: nearest stamp per query; equal distances resolve to the later stamp
+        """
+        assert sorted_stamps.shape[0] > 0, "Cannot search an empty time index"
+        
+        right = np.clip(np.searchsorted(sorted_stamps, queries, side='left'), 0, sorted_stamps.shape[0] - 1)
+        left = np.clip(right - 1, 0, sorted_stamps.shape[0] - 1)
+        take_left = np.abs(queries - sorted_stamps[left]) < np.abs(sorted_stamps[right] - queries)
+        
+        return np.where(take_left, sorted_stamps[left], sorted_stamps[right])
+
+
+def prepared_geometry(feds_poly):
+        """ shapely prepared geometry of feds_poly (None when empty) """
+        feds_geom = feds_poly.geometry.unary_union
+        return None if feds_geom is None or feds_geom.is_empty else prep(feds_geom)
+
+def find_intersecting(feds_poly, ref_polygons, ref_sindex=None, within=None, ref_bounds=None, feds_bounds=None, prepared=None):
+        """ positional indices (ascending) of ref_polygons whose area overlaps feds_poly
+                feds_poly: single row feds GeoDataFrame
+                ref_polygons: reference polygons to search
+                ref_sindex: spatial index of ref_polygons; bbox candidates are pulled from it
+                within: optional array of ref positions to restrict the search to
+                ref_bounds, feds_bounds: optional cached bounds; with within, envelopes are compared
+                                         as arrays instead of querying the spatial index
+                prepared: optional prepared_geometry(feds_poly); built here when not passed
+            returns: list of positions, identical to a per-row gpd.overlay(..., how='intersection') scan
+        """
+        
+        if prepared is None:
+            prepared = prepared_geometry(feds_poly)
+        if prepared is None:
+            return []
+        feds_geom = prepared.context
+        
+        ref_geoms = ref_polygons.geometry.values
+        
+        if within is not None and ref_bounds is not None:
+            # envelope rejection on the (small) windowed subset, exact predicate only on survivors
+            if feds_bounds is None:
+                feds_bounds = feds_geom.bounds
+            candidates = Utilities.bounds_overlap(ref_bounds, feds_bounds, within)
+            candidates = [ref_poly_i for ref_poly_i in candidates if prepared.intersects(ref_geoms[ref_poly_i])]
+        else:
+            # bbox candidates from the index, exact predicate (prepared) only on those
+            if ref_sindex is None:
+                ref_sindex = ref_polygons.sindex
+            candidates = ref_sindex.query(feds_geom)
+            if within is not None:
+                candidates = np.intersect1d(candidates, within)
+            candidates = [ref_poly_i for ref_poly_i in sorted(candidates) if prepared.intersects(ref_geoms[ref_poly_i])]
+        
+        # overlay keeps polygonal output only: shapes meeting on an edge/point produce no intersection
+        return [int(ref_poly_i) for ref_poly_i in candidates if not prepared.touches(ref_geoms[ref_poly_i])]